@@ -1,12 +1,49 @@
-import datetime
 import io
+import os
+import pickle
+import threading
+import time
 import traceback
-from io import BytesIO
-import requests
+from datetime import datetime
 import pandas as pd
-from anticaptchaofficial.imagecaptcha import *
 
 import config
+from metrics import METRICS
+from retry import Deadline, RetryError, RetryPolicy, call_with_retry, single_flight
+
+# Адрес сайта; для локального стенда bench.py подменяется на http://127.0.0.1:<порт>
+BACKOFFICE_URL = getattr(config, "backoffice_url", "https://ru.siberianhealth.com")
+
+SESSION_FILE = getattr(config, "backoffice_session_file", "backoffice_session.pickle")
+SESSION_TTL = getattr(config, "backoffice_session_ttl", 12 * 60 * 60)
+REPORT_CACHE_DIR = getattr(config, "report_cache_dir", "report_cache")
+REPORT_CACHE_TTL = getattr(config, "report_cache_ttl", 60 * 60)
+
+MAX_CONCURRENT_CAPTCHA = getattr(config, "max_concurrent_captcha", 2)
+HTTP_POOL_SIZE = getattr(config, "http_pool_size", 10)
+
+# requests и anticaptchaofficial загружаются только при входе в backoffice:
+# при попадании в кэш выгрузки (load_cached_report) они не нужны
+_http_adapter = None
+_http_adapter_lock = threading.Lock()
+# Ограничение одновременных платных решений капчи
+CAPTCHA_SLOTS = threading.BoundedSemaphore(MAX_CONCURRENT_CAPTCHA)
+# Файл сессий переписывается целиком: сохранения из разных потоков выполняются по очереди
+SESSION_LOCK = threading.Lock()
+
+# Бюджеты повторов: решений капчи на один вход, входов с отказом "Denied" и попыток входа и выгрузки отчета
+CAPTCHA_ATTEMPTS = getattr(config, "captcha_attempts", 5)
+AUTH_ATTEMPTS = getattr(config, "auth_attempts", 3)
+DOWNLOAD_ATTEMPTS = getattr(config, "download_attempts", 3)
+# Общий срок получения выгрузки команды одним аккаунтом, в секундах
+BACKOFFICE_DEADLINE = getattr(config, "backoffice_deadline", 10 * 60)
+
+# Столбцы выгрузки "Моя команда", которые используются при обогащении
+TEAM_COLUMNS = ["Регистрационный номер", "НОО"]
+
+
+class BackofficeError(Exception):
+    pass
 
 
 class myDict(dict):
@@ -17,65 +54,220 @@ class myDict(dict):
             return None
 
 
-def bypass_captcha(session, captcha_key=config.captcha_key):
+def http_adapter():
+    """
+    Возвращает общий пул HTTP-соединений для всех сессий backoffice (в том числе в пакетном режиме).
+    """
+    global _http_adapter
+    with _http_adapter_lock:
+        if _http_adapter is None:
+            from requests.adapters import HTTPAdapter
+
+            _http_adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    return _http_adapter
+
+
+def new_session():
+    """
+    Создает сессию requests, использующую общий пул соединений http_adapter().
+    """
+    import requests
+
+    session = requests.Session()
+    session.mount("https://", http_adapter())
+    session.mount("http://", http_adapter())
+    session.hooks["response"].append(_observe_latency)
+    return session
+
+
+def _observe_latency(response, *args, **kwargs):
+    # elapsed - время до получения заголовков ответа, без чтения тела
+    METRICS.observe("http_request", response.elapsed.total_seconds())
+
+
+def bypass_captcha(session, captcha_key=config.captcha_key, deadline=None):
+    """
+    Получает и решает капчу в рамках сессии, повторяя попытки не больше CAPTCHA_ATTEMPTS раз.
+
+    Raises:
+        RetryError: Если капчу не удалось решить за отведенные попытки или срок.
+    """
+    from anticaptchaofficial.imagecaptcha import imagecaptcha
+
     solver = imagecaptcha()
     # solver.set_verbose(0)  # Установите уровень отладки на 0, чтобы отключить сообщения работы
-    while True:
-        try:
-            solver.set_key(captcha_key)
-            img = session.get("https://ru.siberianhealth.com/ru/captcha/default/")
-            captcha_content = BytesIO(img.content)
-            captcha_text = solver.solve_and_return_solution(
-                file_path=None, body=captcha_content.read()
-            )
-            return captcha_text
-        except:
-            pass
+    solver.set_key(captcha_key)
+
+    def solve():
+        img = session.get(f"{BACKOFFICE_URL}/ru/captcha/default/")
+        img.raise_for_status()
+        with CAPTCHA_SLOTS:
+            started = time.perf_counter()
+            captcha_text = solver.solve_and_return_solution(file_path=None, body=img.content)
+            METRICS.observe("captcha_solve", time.perf_counter() - started)
+        # При неудаче решатель возвращает 0, а причину сохраняет в error_code
+        if not captcha_text:
+            raise BackofficeError(f"капча не решена: {solver.error_code}")
+        return captcha_text
+
+    return call_with_retry("captcha", solve, RetryPolicy(CAPTCHA_ATTEMPTS), deadline)
+
+
+def _read_sessions(filename):
+    """
+    Читает сохраненные сессии; поврежденный или недописанный файл считается пустым.
+    """
+    try:
+        with open(filename, "rb") as file:
+            saved = pickle.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, IndexError, ValueError) as e:
+        print("Не удалось прочитать сохраненные сессии:", e)
+        return {}
+    return saved if isinstance(saved, dict) else {}
+
+
+def load_session(user, filename=SESSION_FILE, ttl=SESSION_TTL):
+    """
+    Возвращает сессию с сохраненными cookie пользователя, если они не старше ttl секунд.
+    """
+    saved = _read_sessions(filename).get(str(user.number))
+    if not saved or time.time() - saved["saved_at"] > ttl:
+        return None
+    session = new_session()
+    session.cookies.update(saved["cookies"])
+    return session
+
+
+def save_session(user, session, filename=SESSION_FILE):
+    """
+    Сохраняет cookie авторизованной сессии пользователя (файл доступен только владельцу).
+
+    Файл общий для всех пользователей, поэтому чтение и запись выполняются
+    под SESSION_LOCK, а запись - атомарно через временный файл, как в UidState.save.
+    """
+    with SESSION_LOCK:
+        saved = _read_sessions(filename)
+        saved[str(user.number)] = {"saved_at": time.time(), "cookies": session.cookies}
+        tmp_filename = f"{filename}.tmp"
+        with open(os.open(tmp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as file:
+            pickle.dump(saved, file)
+        os.replace(tmp_filename, filename)
+
+
+def probe_session(session, url):
+    """
+    Проверяет, что сессия авторизована: backoffice не перенаправляет на страницу входа.
+
+    Returns:
+        str: Текст страницы backoffice или None, если сессия недействительна.
+    """
+    response = session.get(url=url)
+    if response.status_code != 200 or "/backoffice/auth/" in response.url:
+        return None
+    return response.text
 
 
 def auth(
     user,
-    url="https://ru.siberianhealth.com/ru/backoffice-new/?newStyle=yes",
-    url_ajax="https://ru.siberianhealth.com/ru/controller/ajax/",
+    url=None,
+    url_ajax=None,
+    deadline=None,
 ):
+    url = url or f"{BACKOFFICE_URL}/ru/backoffice-new/?newStyle=yes"
+    url_ajax = url_ajax or f"{BACKOFFICE_URL}/ru/controller/ajax/"
+    session = load_session(user)
+    if session is not None:
+        page = probe_session(session, url)
+        if page is not None:
+            METRICS.count("session_cache_hits")
+            if "Стать Бизнес-Партнером" in page:
+                return f"{user.number} нужно стать Бизнес-Партнером"
+            return session
+    METRICS.count("session_cache_misses")
+
     payload = {
         "login": f"{user.number}",
         "pass": f"{user.password}",
         "url": url,
         "_controller": "Backoffice_Auth/submit",
-        "_url": "https://ru.siberianhealth.com/ru/backoffice/auth/?url=https://ru.siberianhealth.com/ru/backoffice-new/?newStyle=yes",
+        "_url": f"{BACKOFFICE_URL}/ru/backoffice/auth/?url={url}",
     }
 
-    with requests.Session() as session:
-        while True:
+    with METRICS.stage("backoffice_login"):
+        session = new_session()
+        for attempt in range(1, AUTH_ATTEMPTS + 1):
             response = session.post(url=url_ajax, data=payload, allow_redirects=True)
             response_json = response.json()
-            if response_json["result"]["status"] == "Denied":
-                payload["captcha"] = bypass_captcha(session)
-            else:
+            if response_json["result"]["status"] != "Denied":
                 break
-        if (
-            response_json["result"]["success"]
-            and "Стать Бизнес-Партнером" not in session.get(url=url).text
-        ):
-            return session
-        elif "Стать Бизнес-Партнером" in session.get(url=url).text:
-            return f"{user.number} нужно стать Бизнес-Партнером"
+            # Капча решается (платно) только если ее решение еще будет отправлено
+            if attempt < AUTH_ATTEMPTS:
+                payload["captcha"] = bypass_captcha(session, deadline=deadline)
         else:
-            return f"{user.number} {response_json['result']['status']}"
+            return f"{user.number} вход не выполнен за {AUTH_ATTEMPTS} попыток"
+
+        page = session.get(url=url).text
+    if "Стать Бизнес-Партнером" in page:
+        return f"{user.number} нужно стать Бизнес-Партнером"
+    if response_json["result"]["success"]:
+        save_session(user, session)
+        return session
+    return f"{user.number} {response_json['result']['status']}"
 
 
 def get_current_period(format):
     return datetime.now().strftime(format)
 
 
+def _report_cache_path(id, period):
+    return os.path.join(REPORT_CACHE_DIR, f"{id}_{period.replace('.', '-')}.feather")
+
+
+def load_cached_report(id, period, ttl=REPORT_CACHE_TTL):
+    """
+    Возвращает выгрузку команды из локального кэша, если она не старше ttl секунд.
+
+    Args:
+        id: Номер договора.
+        period (str): Период отчета в формате ММ.ГГГГ.
+        ttl (int): Срок жизни кэша в секундах.
+
+    Returns:
+        pandas.DataFrame: Выгрузка со столбцами TEAM_COLUMNS или None.
+    """
+    path = _report_cache_path(id, period)
+    if not os.path.exists(path) or time.time() - os.path.getmtime(path) > ttl:
+        METRICS.count("report_cache_misses")
+        return None
+    METRICS.count("report_cache_hits")
+    return pd.read_feather(path, columns=TEAM_COLUMNS)
+
+
+def save_cached_report(df, id, period):
+    """
+    Сохраняет выгрузку команды в кэш в формате Feather.
+    """
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    path = _report_cache_path(id, period)
+    try:
+        df.reset_index(drop=True).to_feather(f"{path}.tmp")
+    except (TypeError, ValueError) as e:
+        # Столбцы со смешанными типами не сохраняются в Feather: работаем без кэша
+        print("Не удалось сохранить выгрузку в кэш:", e)
+        return
+    os.replace(f"{path}.tmp", path)
+
+
 def download_csv_data(
-    id, session, url_ajax="https://ru.siberianhealth.com/ru/controller/ajax/"
+    id, session, url_ajax=None, period=None
 ):
+    url_ajax = url_ajax or f"{BACKOFFICE_URL}/ru/controller/ajax/"
     data = {
         "filters[page]": "1",
         "filters[perPage]": "20",
-        "filters[period]": f'{get_current_period("%m.%Y")}',
+        "filters[period]": period or get_current_period("%m.%Y"),
         "filters[fromCache]": "0",
         "filters[contract]": "",
         "filters[search]": "",
@@ -96,45 +288,88 @@ def download_csv_data(
         "filters[specialGift]": "",
         "_controller": "Backoffice_Report_Inf/download_prepare",
         "_contract": f"{id}",
-        "_url": "https://ru.siberianhealth.com/ru/backoffice/report/inf/",
+        "_url": f"{BACKOFFICE_URL}/ru/backoffice/report/inf/",
     }
 
-    hash = session.post(url_ajax, data=data, allow_redirects=True)
-    hash = hash.json()["result"]["hash"]
-    report = session.get(
-        f"https://ru.siberianhealth.com/ru/backoffice/report/inf/download/{hash}/"
-    )
+    with METRICS.stage("report_download"):
+        hash = session.post(url_ajax, data=data, allow_redirects=True)
+        hash = hash.json()["result"]["hash"]
+        report = session.get(
+            f"{BACKOFFICE_URL}/ru/backoffice/report/inf/download/{hash}/"
+        )
+    METRICS.count("report_bytes", len(report.content))
 
     # with open('Моя команда.xls', 'wb') as file:
     #     file.write(report.content)
 
-    df = pd.read_excel(io.BytesIO(report.content))
+    with METRICS.stage("xls_parse") as stage:
+        df = pd.read_excel(io.BytesIO(report.content), usecols=TEAM_COLUMNS)
+        stage.add(len(df))
     return df
 
 
-def process_user_data(user):
-    try:
-        session = auth(user)
-        if isinstance(session, requests.sessions.Session):
-            dataTeam = download_csv_data(user.number, session)
-            # Выход из цикла, если все прошло успешно
-            return dataTeam
-        else:
+def process_user_data(user, deadline=None):
+    """
+    Возвращает выгрузку команды пользователя из кэша или из backoffice.
+
+    Вход и выгрузка повторяются при сетевых ошибках и неожиданных ответах
+    с экспоненциальной задержкой в пределах DOWNLOAD_ATTEMPTS и deadline.
+    Одновременные запросы одного пользователя (например, несколько ящиков
+    одного партнера в пакетном режиме) выполняют вход и решают капчу один раз.
+
+    Returns:
+        pandas.DataFrame или str: Выгрузка команды или причина неудачи.
+    """
+    period = get_current_period("%m.%Y")
+    dataTeam = load_cached_report(user.number, period)
+    if dataTeam is not None:
+        return dataTeam
+
+    import requests
+
+    def login_and_download():
+        session = auth(user, deadline=deadline)
+        if not isinstance(session, requests.sessions.Session):
             return session
+        dataTeam = download_csv_data(user.number, session, period=period)
+        save_cached_report(dataTeam, user.number, period)
+        return dataTeam
 
-    except Exception as e:
-        print("Произошла ошибка:", e)
-        traceback.print_exc()
-        time.sleep(60)
+    def load():
+        # Пока поток ждал, выгрузку мог сохранить другой поток того же пользователя
+        dataTeam = load_cached_report(user.number, period)
+        if dataTeam is not None:
+            return dataTeam
+        return call_with_retry(
+            "backoffice", login_and_download, RetryPolicy(DOWNLOAD_ATTEMPTS), deadline,
+            retry_on=(requests.RequestException, ValueError, KeyError),
+        )
 
+    try:
+        return single_flight(f"backoffice:{user.number}", load)
+    except RetryError as e:
+        return f"{user.number} {e}"
 
-def backoffice(user=config.user):
+
+def backoffice(user=config.user, deadline_seconds=BACKOFFICE_DEADLINE):
     try:
-        user_data = process_user_data(myDict(user))
+        user_data = process_user_data(myDict(user), Deadline(deadline_seconds))
         return user_data
 
     except Exception as e:
         # Блок обработки исключений
         print("Произошла ошибка:", e)
         traceback.print_exc()
-        time.sleep(60)
+        return f"ошибка backoffice: {e}"
+
+
+def load_team(user=config.user):
+    """
+    Возвращает выгрузку команды или выбрасывает BackofficeError с причиной неудачи.
+    """
+    with METRICS.stage("load_team") as stage:
+        team = backoffice(user)
+        if not isinstance(team, pd.DataFrame):
+            raise BackofficeError(team or "не удалось получить выгрузку команды")
+        stage.add(len(team))
+    return team
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from extractors import DEFAULT_ENGINE
+from mail_fetch import UidState
+from main import run_account
+from registration_store import STORE_FILE, RegistrationStore
+
+# Список аккаунтов: [{"mail_server", "mail_login", "mail_password", "mailbox", "user": {"number", "password"}}]
+ACCOUNTS = getattr(config, "accounts", [])
+BATCH_WORKERS = getattr(config, "batch_workers", 4)
+MAX_IMAP_LOGINS = getattr(config, "max_imap_logins", 4)
+
+
+def account_store_file(mail_login: str) -> str:
+    """
+    Отдельный файл хранилища для каждого аккаунта, чтобы записи разных ящиков не смешивались.
+    """
+    root, ext = os.path.splitext(STORE_FILE)
+    return f"{root}_{mail_login.split('@')[0]}{ext}"
+
+
+def check_account_files(accounts: list) -> None:
+    """
+    Проверяет, что аккаунты пакета не пишут в одни и те же файлы.
+
+    CSV/HTML, хранилище писем, индекс повторов и хранилище строк отчета
+    называются по имени ящика до "@", поэтому leader@mail.ru и
+    leader@gmail.com записывали бы одни файлы из разных потоков.
+
+    Raises:
+        ValueError: Если у двух аккаунтов совпадает имя ящика до "@".
+    """
+    logins = {}
+    for account in accounts:
+        name = account["mail_login"].split("@")[0]
+        if name in logins:
+            raise ValueError(f"Аккаунты {logins[name]} и {account['mail_login']} используют одни и те же файлы "
+                             f"({name}.csv, {account_store_file(account['mail_login'])} и др.)")
+        logins[name] = account["mail_login"]
+
+
+def process_account(account: dict, uid_state: UidState, imap_slots, workers: int, engine: str) -> dict:
+    """
+    Обрабатывает один аккаунт и возвращает строку сводки; ошибки не прерывают пакет.
+    """
+    started = time.perf_counter()
+    summary = {"Аккаунт": account["mail_login"], "Регистраций": 0, "Закрыто": 0, "Статус": "OK"}
+    store = RegistrationStore(account_store_file(account["mail_login"]))
+    try:
+        report = run_account(
+            account["mail_server"],
+            account["mail_login"],
+            account["mail_password"],
+            account["mailbox"],
+            account["user"],
+            uid_state,
+            store,
+            workers=workers,
+            engine=engine,
+            imap_slots=imap_slots,
+        )
+        summary["Регистраций"] = len(report)
+        summary["Закрыто"] = int(report["Сообщение"].notna().sum())
+    except Exception as e:
+        summary["Статус"] = f"{type(e).__name__}: {e}"
+    finally:
+        store.close()
+    summary["Время, с"] = round(time.perf_counter() - started, 1)
+    return summary
+
+
+def run_batch(accounts: list = ACCOUNTS, batch_workers: int = BATCH_WORKERS,
+              max_imap_logins: int = MAX_IMAP_LOGINS, workers: int = 1,
+              engine: str = DEFAULT_ENGINE) -> list:
+    """
+    Обрабатывает несколько аккаунтов ограниченным пулом потоков.
+
+    Одновременные подключения к IMAP ограничены max_imap_logins, решения
+    капчи - backoffice.CAPTCHA_SLOTS, а HTTP-сессии всех аккаунтов используют
+    общий пул соединений backoffice.http_adapter(). Каждый аккаунт сохраняет
+    свои CSV/HTML.
+
+    Args:
+        accounts (list): Список аккаунтов.
+        batch_workers (int): Количество аккаунтов, обрабатываемых одновременно.
+        max_imap_logins (int): Максимум одновременных подключений к IMAP.
+        workers (int): Количество процессов для разбора писем каждого аккаунта.
+        engine (str): Движок извлечения текста.
+
+    Returns:
+        list: Сводка по каждому аккаунту.
+
+    Raises:
+        ValueError: Если файлы аккаунтов совпадают (см. check_account_files).
+    """
+    check_account_files(accounts)
+    uid_state = UidState()
+    imap_slots = threading.BoundedSemaphore(max_imap_logins)
+    with ThreadPoolExecutor(max_workers=batch_workers) as executor:
+        summary = list(executor.map(
+            lambda account: process_account(account, uid_state, imap_slots, workers, engine),
+            accounts,
+        ))
+    uid_state.save()
+    return summary
+
+
+def print_summary(summary: list) -> None:
+    if not summary:
+        print("Нет аккаунтов для обработки")
+        return
+    headers = list(summary[0])
+    widths = [max(len(str(header)), *(len(str(row[header])) for row in summary)) for header in headers]
+    print("  ".join(str(header).ljust(width) for header, width in zip(headers, widths)))
+    for row in summary:
+        print("  ".join(str(row[header]).ljust(width) for header, width in zip(headers, widths)))
+
+
+if __name__ == "__main__":
+    import sys
+
+    import cli
+
+    cli.main(["batch", *sys.argv[1:]])
@@ -0,0 +1,408 @@
+import io
+import json
+import os
+import platform
+import re
+import socketserver
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from email.message import EmailMessage
+from email.policy import SMTP
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count, islice
+from urllib.parse import parse_qs
+
+import pandas as pd
+
+import backoffice
+import config
+import main
+from enrichment import enrich, write_csv
+from extractors import DEFAULT_ENGINE
+from mail_fetch import REGISTRATION_SUBJECT, SYNC_CONNECTIONS, UidState
+from main_v2 import EmailParser
+from metrics import METRICS
+
+BENCH_SIZES = getattr(config, "bench_sizes", [100, 1000, 5000])
+BENCH_TEAM_ROWS = getattr(config, "bench_team_rows", 5000)
+BENCH_RESULTS_FILE = getattr(config, "bench_results_file", "bench_results.json")
+
+BENCH_LOGIN = "bench@localhost"
+BENCH_PASSWORD = "bench"
+BENCH_FOLDER = "INBOX"
+BENCH_USER = {"number": "2500000000", "password": "bench"}
+
+FIRST_REG_NUMBER = 2500000000
+# Каждое NOISE_EVERY-е письмо - не о регистрации, каждая REPEAT_EVERY-я регистрация - повтор
+NOISE_EVERY = 10
+REPEAT_EVERY = 20
+
+
+def registration_letter(i: int, agreement: bool = False) -> str:
+    """
+    HTML-тело письма о регистрации по текущему шаблону.
+
+    Args:
+        i (int): Порядковый номер регистрации.
+        agreement (bool): Вариант шаблона с "Номер Соглашения:" вместо "Регистрационный номер:".
+    """
+    label = "Номер Соглашения:" if agreement else "Регистрационный номер:"
+    tier = "Бизнес-Партнер" if i % 3 else "Привилегированный клиент"
+    person = i - 1 if i and i % REPEAT_EVERY == 0 else i
+    phone = f"375{person:09d}" if i % 7 == 0 else f"7999{person:07d}"
+    return f"""<html><body>
+<table><tr><td><h1>Siberian Wellness</h1></td></tr>
+<tr><td><h2>В вашей команде новый {tier}!</h2></td></tr>
+<tr><td><p>Иванов{person} Иван Петрович</p></td></tr>
+<tr><td><p>{label} {FIRST_REG_NUMBER + i}</p></td></tr>
+<tr><td><p>Телефон: {phone}</p></td></tr>
+<tr><td><p>E-mail: <a href="mailto:user{person}@mail.ru">user{person}@mail.ru</a></p></td></tr>
+<tr><td><p>С уважением, команда <a href="https://ru.siberianhealth.com/">Siberian Wellness</a></p></td></tr>
+</table></body></html>"""
+
+
+def synthetic_mailbox(letters: int) -> list:
+    """
+    Письма для стенда IMAP: letters писем о регистрации (оба варианта шаблона) и примешанные к ним посторонние.
+
+    Returns:
+        list: Пары (тема, письмо RFC 822 в байтах) в порядке UID.
+    """
+    messages = []
+    for i in range(letters):
+        if i % NOISE_EVERY == NOISE_EVERY - 1:
+            messages.append(_message(f"Siberian Wellness: новости компании {i}", "<html><body>Новости</body></html>",
+                                     len(messages) + 1))
+        messages.append(_message(REGISTRATION_SUBJECT, registration_letter(i, agreement=i % 2 == 1),
+                                 len(messages) + 1))
+    return messages
+
+
+def _message(subject: str, html: str, uid: int) -> tuple:
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = "Siberian Wellness <noreply@siberianhealth.com>"
+    msg["To"] = BENCH_LOGIN
+    msg["Date"] = format_datetime(datetime(2024, 1, 1, tzinfo=timezone.utc))
+    msg["Message-ID"] = f"<bench-{uid}@localhost>"
+    msg.set_content(html, subtype="html")
+    return subject, msg.as_bytes(policy=SMTP)
+
+
+def synthetic_team(rows: int) -> pd.DataFrame:
+    """
+    Выгрузка "Моя команда" из rows строк.
+
+    В команду входят две трети регистраций из synthetic_mailbox (каждая
+    третья считается закрытой), остальные строки - другие участники.
+    """
+    reg_numbers = list(islice((FIRST_REG_NUMBER + k for k in count() if k % 3), rows))
+    return pd.DataFrame({
+        "ФИО": [f"Иванов{k} Иван Петрович" for k in range(rows)],
+        "E-mail": [f"user{k}@mail.ru" for k in range(rows)],
+        "Телефон": [7999_0000000 + k for k in range(rows)],
+        "Регистрационный номер": reg_numbers,
+        "НОО": [(0, 12.5, 3, 0.4)[k % 4] for k in range(rows)],
+        "Квалификация": ["Консультант"] * rows,
+    })
+
+
+def team_workbook(team: pd.DataFrame) -> bytes:
+    buffer = io.BytesIO()
+    team.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+_TOKEN = re.compile(rb'"((?:[^"\\]|\\.)*)"|([^\s()]+)')
+
+
+class _ImapHandler(socketserver.StreamRequestHandler):
+    # Ответ на команду собирается в буфере и отправляется целиком (см. handle)
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def send(self, line) -> None:
+        self.wfile.write((line if isinstance(line, bytes) else line.encode()) + b"\r\n")
+
+    def handle(self) -> None:
+        self.send("* OK IMAP4rev1 bench stand-in ready")
+        self.wfile.flush()
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, rest = line.rstrip(b"\r\n").partition(b" ")
+            command, _, args = rest.partition(b" ")
+            command = command.upper()
+            if command == b"UID":
+                command, _, args = args.partition(b" ")
+                command = b"UID " + command.upper()
+            tag = tag.decode()
+
+            if command == b"LOGOUT":
+                self.send("* BYE bench stand-in closing")
+                self.send(f"{tag} OK LOGOUT completed")
+                self.wfile.flush()
+                return
+            handler = {
+                b"CAPABILITY": self.capability,
+                b"LOGIN": self.ok,
+                b"NOOP": self.ok,
+                b"SELECT": self.select,
+                b"EXAMINE": self.select,
+                b"STATUS": self.status,
+                b"UID SEARCH": self.search,
+                b"UID FETCH": self.fetch,
+            }.get(command)
+            if handler is None:
+                self.send(f"{tag} BAD unsupported command")
+            else:
+                handler(tag, args)
+            self.wfile.flush()
+
+    def ok(self, tag, args) -> None:
+        self.send(f"{tag} OK completed")
+
+    def capability(self, tag, args) -> None:
+        self.send("* CAPABILITY IMAP4rev1 IDLE")
+        self.ok(tag, args)
+
+    def select(self, tag, args) -> None:
+        server = self.server
+        self.send(f"* {len(server.messages)} EXISTS")
+        self.send("* 0 RECENT")
+        self.send(f"* OK [UIDVALIDITY {server.uidvalidity}] UIDs valid")
+        self.send(f"* OK [UIDNEXT {len(server.messages) + 1}] next UID")
+        self.send(f"{tag} OK [READ-WRITE] SELECT completed")
+
+    def status(self, tag, args) -> None:
+        server = self.server
+        values = {"MESSAGES": len(server.messages), "RECENT": 0, "UIDNEXT": len(server.messages) + 1,
+                  "UIDVALIDITY": server.uidvalidity, "UNSEEN": 0}
+        folder = _TOKEN.match(args).group(0).decode()
+        items = re.findall(r"[A-Z]+", args[len(folder):].decode().upper())
+        self.send(f"* STATUS {folder} ({' '.join(f'{item} {values[item]}' for item in items if item in values)})")
+        self.ok(tag, args)
+
+    def _uid_set(self, text: str) -> list:
+        last = len(self.server.messages)
+        uids = set()
+        for part in text.split(","):
+            start, _, end = part.partition(":")
+            start = last if start == "*" else int(start)
+            end = start if not end else last if end == "*" else int(end)
+            uids.update(range(min(start, end), max(start, end) + 1))
+        return sorted(uid for uid in uids if 1 <= uid <= last)
+
+    def search(self, tag, args) -> None:
+        tokens = [(match.group(1) if match.group(1) is not None else match.group(2)).decode()
+                  for match in _TOKEN.finditer(args)]
+        uids = range(1, len(self.server.messages) + 1)
+        for key, value in zip(tokens, tokens[1:]):
+            if key.upper() == "UID":
+                uids = [uid for uid in self._uid_set(value) if uid in uids]
+            elif key.upper() == "SUBJECT":
+                needle = value.lower()
+                uids = [uid for uid in uids if needle in self.server.messages[uid - 1][0].lower()]
+        self.send(f"* SEARCH {' '.join(map(str, uids))}".rstrip())
+        self.ok(tag, args)
+
+    def fetch(self, tag, args) -> None:
+        uid_set, _, parts = args.decode().partition(" ")
+        headers_only = "HEADER" in parts.upper()
+        for uid in self._uid_set(uid_set):
+            data = self.server.messages[uid - 1][1]
+            if headers_only:
+                data = data.split(b"\r\n\r\n", 1)[0] + b"\r\n\r\n"
+            section = "BODY[HEADER]" if headers_only else "BODY[]"
+            self.wfile.write(
+                f"* {uid} FETCH (UID {uid} FLAGS () RFC822.SIZE {len(self.server.messages[uid - 1][1])} "
+                f"{section} {{{len(data)}}}\r\n".encode() + data + b")\r\n"
+            )
+        self.ok(tag, args)
+
+
+class _StandIn:
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ImapStandIn(_StandIn):
+    def __init__(self, messages: list, uidvalidity: int = 1):
+        """
+        Локальный IMAP-сервер без шифрования с одной папкой.
+
+        Поддерживает ровно те команды, которые использует imap_tools в
+        mail_fetch: LOGIN, SELECT, STATUS, UID SEARCH (по UID и SUBJECT) и
+        UID FETCH. UID письма - его номер в messages, начиная с 1.
+
+        Args:
+            messages (list): Пары (тема, письмо RFC 822 в байтах), см. synthetic_mailbox.
+            uidvalidity (int): UIDVALIDITY папки.
+        """
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _ImapHandler)
+        self.server.daemon_threads = True
+        self.server.messages = messages
+        self.server.uidvalidity = uidvalidity
+
+    @property
+    def address(self) -> str:
+        return f"imap://127.0.0.1:{self.server.server_address[1]}"
+
+
+class _BackofficeHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def reply(self, body: bytes, content_type: str, headers: dict = None) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode())
+        controller = form.get("_controller", [""])[0]
+        if self.path == "/ru/controller/ajax/" and controller == "Backoffice_Auth/submit":
+            self.reply(json.dumps({"result": {"status": "Success", "success": True}}).encode(),
+                       "application/json", {"Set-Cookie": "PHPSESSID=bench; Path=/"})
+        elif self.path == "/ru/controller/ajax/" and controller == "Backoffice_Report_Inf/download_prepare":
+            self.reply(json.dumps({"result": {"hash": "bench"}}).encode(), "application/json")
+        else:
+            self.send_error(404)
+
+    def do_GET(self) -> None:
+        if self.path.startswith("/ru/backoffice-new/"):
+            self.reply("<html><body>Backoffice</body></html>".encode(), "text/html; charset=utf-8")
+        elif self.path == "/ru/backoffice/report/inf/download/bench/":
+            self.reply(self.server.workbook, "application/vnd.ms-excel")
+        else:
+            self.send_error(404)
+
+
+class BackofficeStandIn(_StandIn):
+    def __init__(self, workbook: bytes):
+        """
+        Локальная замена backoffice: авторизация и выгрузка "Моя команда" через /ru/controller/ajax/.
+
+        Авторизация проходит без капчи, отчет отдается из workbook.
+
+        Args:
+            workbook (bytes): Файл Excel с выгрузкой команды (см. team_workbook).
+        """
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _BackofficeHandler)
+        self.server.daemon_threads = True
+        self.server.workbook = workbook
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+
+def _timed(seconds: dict, stage: str, function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    seconds[stage] = round(time.perf_counter() - started, 4)
+    return result
+
+
+def run_size(letters: int, team_rows: int, connections: int = SYNC_CONNECTIONS, engine: str = DEFAULT_ENGINE) -> dict:
+    """
+    Замеряет этапы обработки для одного размера входных данных.
+
+    Все файлы (состояние UID, сессия, кэш выгрузки, CSV/HTML) создаются во
+    временном каталоге, поэтому каждый замер начинается "с нуля".
+
+    Args:
+        letters (int): Количество писем о регистрации.
+        team_rows (int): Количество строк выгрузки команды.
+        connections (int): Количество подключений к IMAP для fetch_emails.
+        engine (str): Движок извлечения текста.
+
+    Returns:
+        dict: Размеры, количества, время этапов в секундах и счетчики metrics.
+    """
+    METRICS.reset()
+    seconds = {}
+    workdir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp, \
+            ImapStandIn(synthetic_mailbox(letters)) as imap, \
+            BackofficeStandIn(team_workbook(synthetic_team(team_rows))) as site:
+        os.chdir(tmp)
+        backoffice_url, backoffice.BACKOFFICE_URL = backoffice.BACKOFFICE_URL, site.url
+        try:
+            messages = _timed(seconds, "fetch_emails", main.fetch_emails, imap.address, BENCH_LOGIN,
+                              BENCH_PASSWORD, BENCH_FOLDER, state=UidState("mail_state.json"),
+                              connections=connections)
+            records = _timed(seconds, "process_messages", main.process_messages, messages, engine=engine)
+            parser = EmailParser(imap.address, BENCH_LOGIN, BENCH_PASSWORD, BENCH_FOLDER, engine=engine)
+            _timed(seconds, "parse_emails", parser.parse_emails)
+            team = _timed(seconds, "load_team", backoffice.load_team, BENCH_USER)
+            _timed(seconds, "load_team_cached", backoffice.load_team, BENCH_USER)
+            records = _timed(seconds, "check_duplicates", main.check_duplicates, records)
+            report = _timed(seconds, "enrich", enrich, records, team)
+            _timed(seconds, "write_csv", write_csv, report, "bench.csv")
+            closed = report[report["Сообщение"].notna()].to_dict("records")
+            _timed(seconds, "save_to_html", main.save_to_html, closed, "bench.html")
+        finally:
+            backoffice.BACKOFFICE_URL = backoffice_url
+            os.chdir(workdir)
+    return {
+        "letters": letters,
+        "team_rows": team_rows,
+        "fetched": len(messages),
+        "registrations": len(records),
+        "closed": len(closed),
+        "seconds": seconds,
+        "counters": METRICS.report()["counters"],
+    }
+
+
+def run_bench(sizes: list = BENCH_SIZES, team_rows: int = BENCH_TEAM_ROWS, connections: int = SYNC_CONNECTIONS,
+              engine: str = DEFAULT_ENGINE) -> dict:
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "engine": engine,
+        "connections": connections,
+        "results": [run_size(letters, team_rows, connections, engine) for letters in sizes],
+    }
+
+
+def print_results(report: dict, baseline: dict = None) -> None:
+    """
+    Печатает время этапов; если передан прошлый отчет, рядом выводится отношение к нему.
+    """
+    previous = {result["letters"]: result["seconds"] for result in (baseline or {}).get("results", [])}
+    for result in report["results"]:
+        print(f"\nПисем: {result['letters']}, строк команды: {result['team_rows']}, "
+              f"регистраций: {result['registrations']}")
+        for stage, value in result["seconds"].items():
+            line = f"  {stage:<18} {value:>9.3f} с"
+            old = previous.get(result["letters"], {}).get(stage)
+            if old:
+                line += f"  x{value / old:.2f} к прошлому замеру"
+            print(line)
+
+
+if __name__ == "__main__":
+    import sys
+
+    import cli
+
+    cli.main(["bench", *sys.argv[1:]])
@@ -0,0 +1,257 @@
+import argparse
+import os
+import subprocess
+import sys
+
+import config
+from metrics import METRICS_FILE, PROMETHEUS_TEXTFILE
+
+# Тяжелые модули загружаются только внутри команд, которым они нужны:
+# разбор аргументов и команда report обходятся без них
+HEAVY_MODULES = ("pandas", "numpy", "lxml", "bs4", "imap_tools", "requests", "anticaptchaofficial", "openpyxl")
+
+# Модули, которые загружает каждая команда (для проверки времени запуска: python cli.py bench --imports)
+COMMAND_MODULES = {
+    "fetch": ("main",),
+    "report": ("html_report",),
+    "watch": ("watch",),
+    "batch": ("batch",),
+    "bench": ("bench",),
+}
+LIGHT_COMMANDS = ("report",)
+# Допустимое время импорта CLI и легких команд, в секундах
+IMPORT_TIME_BUDGET = getattr(config, "import_time_budget", 0.2)
+
+# Как в extractors.ENGINES; сам модуль не импортируется, чтобы не загружать lxml при запуске
+ENGINE_CHOICES = ("bs4", "lxml")
+
+_IMPORT_PROBE = """
+import sys, time
+started = time.perf_counter()
+import {modules}
+print(time.perf_counter() - started)
+print(" ".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+
+def fetch_command(args):
+    from extractors import DEFAULT_ENGINE
+    from mail_fetch import SYNC_CONNECTIONS, UidState
+    from metrics import METRICS
+
+    engine = args.engine or DEFAULT_ENGINE
+    if args.v2:
+        import main_v2
+
+        main_v2.run_account(config.mail_server, config.mail_login, config.mail_password, config.mailbox,
+                            config.user, engine=engine)
+    else:
+        import main
+        from registration_store import RegistrationStore
+
+        uid_state = UidState()
+        store = RegistrationStore()
+        connections = args.connections or SYNC_CONNECTIONS
+        if args.stream:
+            main.run_account_streaming(config.mail_server, config.mail_login, config.mail_password, config.mailbox,
+                                       config.user, uid_state, store, workers=args.workers, engine=engine,
+                                       connections=connections)
+        else:
+            main.run_account(config.mail_server, config.mail_login, config.mail_password, config.mailbox,
+                             config.user, uid_state, store, workers=args.workers, engine=engine,
+                             connections=connections, incremental_output=args.incremental_output)
+        store.close()
+        uid_state.save()
+
+    METRICS.write(args.metrics_json, args.prometheus_textfile)
+
+
+def report_command(args):
+    if args.export_parquet:
+        from output_store import OutputStore
+
+        output_store = OutputStore.for_account(config.mail_login)
+        output_store.export_parquet(args.export_parquet)
+        output_store.close()
+        return
+
+    from html_report import iter_closed, write_html_report
+
+    csv_filename = args.csv or f'{config.mail_login.split("@")[0]}.csv'
+    if not os.path.exists(csv_filename):
+        raise SystemExit(f"Нет файла {csv_filename}: сначала выполните команду fetch")
+    html_filename = args.html or f"{os.path.splitext(csv_filename)[0]}.html"
+    pages = write_html_report(iter_closed(csv_filename), html_filename)
+    print(f"{html_filename}: страниц {pages}")
+
+
+def watch_command(args):
+    from duplicate_index import DuplicateIndex
+    from extractors import DEFAULT_ENGINE
+    from mail_fetch import UidState
+    from registration_store import RegistrationStore
+    from watch import RegistrationWatcher
+
+    store = RegistrationStore()
+    duplicates = DuplicateIndex.for_account(config.mail_login)
+    try:
+        RegistrationWatcher(config.mail_server, config.mail_login, config.mail_password, config.mailbox,
+                            config.user, UidState(), store, engine=args.engine or DEFAULT_ENGINE,
+                            duplicates=duplicates).run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        duplicates.close()
+        store.close()
+
+
+def batch_command(args):
+    import batch
+    from extractors import DEFAULT_ENGINE
+    from metrics import METRICS
+
+    try:
+        summary = batch.run_batch(batch_workers=args.batch_workers or batch.BATCH_WORKERS,
+                                  max_imap_logins=args.max_imap_logins or batch.MAX_IMAP_LOGINS,
+                                  workers=args.workers, engine=args.engine or DEFAULT_ENGINE)
+    except ValueError as e:
+        raise SystemExit(f"Ошибка в accounts: {e}")
+    batch.print_summary(summary)
+    METRICS.write(args.metrics_json, args.prometheus_textfile)
+
+
+def bench_command(args):
+    if args.imports:
+        raise SystemExit(0 if check_import_times() else 1)
+
+    import json
+
+    import bench
+    from extractors import DEFAULT_ENGINE
+    from mail_fetch import SYNC_CONNECTIONS
+
+    sizes = [int(size) for size in args.sizes.split(",")] if args.sizes else bench.BENCH_SIZES
+    report = bench.run_bench(sizes, args.team_rows or bench.BENCH_TEAM_ROWS, args.connections or SYNC_CONNECTIONS,
+                             args.engine or DEFAULT_ENGINE)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+    bench.print_results(report, baseline)
+    with open(args.output or bench.BENCH_RESULTS_FILE, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+def measure_import(modules: tuple, repeat: int = 3) -> tuple:
+    """
+    Замеряет импорт модулей в отдельном интерпретаторе (лучший из repeat запусков).
+
+    Returns:
+        tuple: Время в секундах и список загруженных тяжелых модулей.
+    """
+    code = _IMPORT_PROBE.format(modules=", ".join(modules), heavy=HEAVY_MODULES)
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.splitlines()
+        seconds = float(output[0])
+        best = seconds if best is None else min(best, seconds)
+    return best, output[1].split() if len(output) > 1 else []
+
+
+def check_import_times(budget: float = IMPORT_TIME_BUDGET) -> bool:
+    """
+    Печатает время запуска CLI и каждой команды.
+
+    Запуск CLI и легкие команды (LIGHT_COMMANDS) не должны загружать
+    тяжелые модули и укладываться в budget секунд.
+
+    Returns:
+        bool: True, если проверка пройдена.
+    """
+    ok = True
+    for name, modules in [("cli", ("cli",))] + [(command, ("cli",) + modules)
+                                                  for command, modules in COMMAND_MODULES.items()]:
+        seconds, heavy = measure_import(modules)
+        light = name == "cli" or name in LIGHT_COMMANDS
+        passed = not light or (not heavy and seconds <= budget)
+        ok = ok and passed
+        print(f"  {name:<8} {seconds:7.3f} с  {' '.join(heavy) or '-':<60} {'' if passed else 'ПРЕВЫШЕНО'}")
+    print(f"Допустимое время запуска CLI и команд {', '.join(LIGHT_COMMANDS)}: {budget} с")
+    return ok
+
+
+def build_parser() -> argparse.ArgumentParser:
+    arg_parser = argparse.ArgumentParser(description="Парсер писем о новых регистрациях")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    fetch_parser = commands.add_parser("fetch", help="загрузить письма и выгрузку команды, сохранить CSV и HTML")
+    fetch_parser.add_argument("--workers", type=int, default=1,
+                              help="количество процессов для разбора писем")
+    fetch_parser.add_argument("--engine", choices=ENGINE_CHOICES, default=None,
+                              help="движок извлечения текста из писем (по умолчанию extraction_engine)")
+    # Потоковый режим всегда переписывает CSV целиком и не ведет хранилище строк отчета
+    output_mode = fetch_parser.add_mutually_exclusive_group()
+    output_mode.add_argument("--stream", action="store_true",
+                             help="потоковая обработка с постоянным расходом памяти")
+    fetch_parser.add_argument("--connections", type=int, default=None,
+                              help="количество подключений к IMAP для первичной загрузки большой папки "
+                                   "(по умолчанию initial_sync_connections, то есть 1)")
+    output_mode.add_argument("--incremental-output", action="store_true",
+                             help="дописывать в CSV только новые и изменившиеся строки (несовместимо с --stream)")
+    fetch_parser.add_argument("--v2", action="store_true",
+                              help="CSV в формате main_v2 (столбец WhatsApp с формулой ГИПЕРССЫЛКА)")
+    fetch_parser.add_argument("--metrics-json", metavar="PATH", default=METRICS_FILE,
+                              help="файл отчета о запуске (время этапов и счетчики) в JSON")
+    fetch_parser.add_argument("--prometheus-textfile", metavar="PATH", default=PROMETHEUS_TEXTFILE,
+                              help="файл показателей для textfile collector Prometheus")
+    fetch_parser.set_defaults(handler=fetch_command)
+
+    report_parser = commands.add_parser("report", help="пересобрать HTML-отчет из CSV без обращения к почте и backoffice")
+    report_parser.add_argument("--csv", metavar="PATH", help="CSV с регистрациями (по умолчанию <ящик>.csv)")
+    report_parser.add_argument("--html", metavar="PATH", help="первая страница отчета (по умолчанию имя CSV с .html)")
+    report_parser.add_argument("--export-parquet", metavar="PATH",
+                               help="выгрузить накопленные строки отчета (--incremental-output) в Parquet")
+    report_parser.set_defaults(handler=report_command)
+
+    watch_parser = commands.add_parser("watch", help="отслеживать новые регистрации в реальном времени")
+    watch_parser.add_argument("--engine", choices=ENGINE_CHOICES, default=None,
+                              help="движок извлечения текста из писем")
+    watch_parser.set_defaults(handler=watch_command)
+
+    batch_parser = commands.add_parser("batch", help="обработать несколько аккаунтов (accounts в config.py)")
+    batch_parser.add_argument("--batch-workers", type=int, default=None,
+                              help="количество аккаунтов, обрабатываемых одновременно (по умолчанию batch_workers)")
+    batch_parser.add_argument("--max-imap-logins", type=int, default=None,
+                              help="максимум одновременных подключений к IMAP (по умолчанию max_imap_logins)")
+    batch_parser.add_argument("--workers", type=int, default=1,
+                              help="количество процессов для разбора писем каждого аккаунта")
+    batch_parser.add_argument("--engine", choices=ENGINE_CHOICES, default=None,
+                              help="движок извлечения текста из писем")
+    batch_parser.add_argument("--metrics-json", metavar="PATH", default=METRICS_FILE,
+                              help="файл отчета о запуске (время этапов и счетчики) в JSON")
+    batch_parser.add_argument("--prometheus-textfile", metavar="PATH", default=PROMETHEUS_TEXTFILE,
+                              help="файл показателей для textfile collector Prometheus")
+    batch_parser.set_defaults(handler=batch_command)
+
+    bench_parser = commands.add_parser("bench", help="замер скорости этапов на синтетических данных")
+    bench_parser.add_argument("--sizes", help="количество писем через запятую (по умолчанию bench_sizes)")
+    bench_parser.add_argument("--team-rows", type=int, help="количество строк выгрузки команды")
+    bench_parser.add_argument("--connections", type=int, help="количество подключений к IMAP")
+    bench_parser.add_argument("--engine", choices=ENGINE_CHOICES, default=None,
+                              help="движок извлечения текста из писем")
+    bench_parser.add_argument("--output", help="файл для результатов в JSON (по умолчанию bench_results_file)")
+    bench_parser.add_argument("--baseline", help="прошлый файл результатов для сравнения")
+    bench_parser.add_argument("--imports", action="store_true",
+                              help="замерить время запуска CLI и команд вместо замера этапов")
+    bench_parser.set_defaults(handler=bench_command)
+    return arg_parser
+
+
+def main(argv: list = None) -> None:
+    args = build_parser().parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
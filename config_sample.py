@@ -11,4 +11,100 @@ USER = {
 MAIL_LOGIN = "sample_mail_login"
 MAIL_PASSWORD = "sample_mail_password"
 MAILBOX = "sample_mailbox"
-MAIL_SERVER = "imap.mail.RU"
\ No newline at end of file
+MAIL_SERVER = "imap.mail.RU"
+
+# Необязательные настройки (если не заданы, используются значения по умолчанию)
+
+# Файл с водяными знаками UID для инкрементальной выборки писем
+mail_state_file = "mail_state.json"
+
+# Адрес отправителя писем о регистрации для фильтрации на стороне сервера (None - не фильтровать)
+registration_sender = None
+
+# База SQLite с уже разобранными письмами о регистрации
+registration_store_file = "registrations.sqlite3"
+# Размер страницы при чтении истории в потоковом режиме: между страницами база не блокируется
+registration_history_page_size = 1000
+
+# Движок извлечения текста из писем: "lxml" (быстрый) или "bs4" (эталонный BeautifulSoup)
+extraction_engine = "lxml"
+
+# Файл с cookie авторизованной сессии backoffice и срок их жизни в секундах
+backoffice_session_file = "backoffice_session.pickle"
+backoffice_session_ttl = 12 * 60 * 60
+
+# Кэш выгрузки команды из backoffice (Feather) и срок его жизни в секундах
+report_cache_dir = "report_cache"
+report_cache_ttl = 60 * 60
+
+# Ограничения параллелизма: одновременные решения капчи и размер общего пула HTTP-соединений
+max_concurrent_captcha = 2
+http_pool_size = 10
+
+# Пакетный режим (batch.py): список аккаунтов и ограничения пула
+accounts = [
+    {
+        "mail_server": "imap.mail.RU",
+        "mail_login": "sample_mail_login",
+        "mail_password": "sample_mail_password",
+        "mailbox": "sample_mailbox",
+        "user": {"number": "sample_number", "password": "sample_password"},
+    },
+]
+batch_workers = 4
+max_imap_logins = 4
+
+# Потоковый режим (main.py --stream): размер порции писем и размер буфера между загрузкой и записью
+stream_chunk_size = 100
+stream_buffer_size = 500
+
+# Режим наблюдения (watch.py): период переподачи IDLE, обновления выгрузки команды, повтора неудачного обновления
+# и максимальная задержка переподключения, в секундах
+watch_idle_timeout = 5 * 60
+watch_roster_refresh = 60 * 60
+watch_roster_retry = 5 * 60
+watch_reconnect_max_delay = 5 * 60
+
+# Параллельная первичная загрузка большой папки (main.py --connections N): максимум подключений к IMAP и буфер каждого диапазона.
+# По умолчанию 1 (параллельная загрузка выключена); небольшие инкрементальные загрузки и так идут по одному подключению.
+initial_sync_connections = 1
+initial_sync_buffer_size = 200
+
+# Хранилище строк отчета для режима --incremental-output ({account} - имя почтового ящика до "@")
+output_store_file = "{account}_rows.sqlite3"
+
+# Количество строк на одной странице HTML-отчета (страницы 2, 3... сохраняются как <имя>.page2.html, <имя>.page3.html)
+html_page_size = 1000
+
+# Постоянный индекс повторных регистраций ({account} - имя почтового ящика до "@")
+duplicate_index_file = "{account}_duplicates.sqlite3"
+
+# Адрес backoffice (для проверки на локальном стенде можно указать http://127.0.0.1:<порт>)
+backoffice_url = "https://ru.siberianhealth.com"
+
+# Замеры скорости (bench.py): количество писем для каждого замера, строк в выгрузке команды и файл результатов
+bench_sizes = [100, 1000, 5000]
+bench_team_rows = 5000
+bench_results_file = "bench_results.json"
+
+# Отчет о запуске: время этапов, количество элементов, байты, попадания в кэш, попытки капчи, задержки HTTP.
+# metrics_file - JSON; prometheus_textfile - файл для textfile collector из node_exporter (None - не писать)
+metrics_file = "run_report.json"
+prometheus_textfile = None
+
+# Повторы при работе с backoffice: попыток решения капчи на один вход, входов с отказом "Denied",
+# попыток входа и выгрузки отчета при сетевых ошибках; задержка между повторами растет от retry_base_delay
+# до retry_max_delay секунд (со случайным разбросом), backoffice_deadline - общий срок на аккаунт в секундах
+captcha_attempts = 5
+auth_attempts = 3
+download_attempts = 3
+retry_base_delay = 2
+retry_max_delay = 60
+backoffice_deadline = 600
+
+# Дополнительные шаблоны писем о регистрации: подпись строки с регистрационным номером и смещение строки с именем
+# относительно нее (встроенные шаблоны: "Регистрационный номер:" и "Номер Соглашения:", имя - в предыдущей строке)
+letter_templates = []
+
+# Допустимое время запуска CLI и команды report в секундах (проверка: python cli.py bench --imports)
+import_time_budget = 0.2
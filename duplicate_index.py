@@ -0,0 +1,144 @@
+import re
+import sqlite3
+
+import config
+
+# {account} заменяется на имя почтового ящика до "@"
+DUPLICATE_INDEX_FILE = getattr(config, "duplicate_index_file", "{account}_duplicates.sqlite3")
+
+FIRST_NOTE = "Первая регистрация"
+REPEAT_NOTE = "Повторная регистрация"
+
+_NON_DIGITS = re.compile(r"\D")
+
+
+def _is_missing(value) -> bool:
+    # NaN не равен сам себе; pandas здесь не нужен: регистрации приходят из писем и хранилища
+    return value is None or value != value
+
+
+def normalize_phone(value) -> str:
+    """
+    Приводит телефон к номеру без кода страны, чтобы разные записи одного номера совпадали:
+    "+7 999 123-45-67", "89991234567", 79991234567.0 -> "9991234567";
+    "+375 29 123-45-67", "80291234567" -> "291234567".
+    """
+    if _is_missing(value):
+        return ""
+    if isinstance(value, float):
+        value = int(value)
+    digits = _NON_DIGITS.sub("", str(value))
+    if len(digits) == 12 and digits.startswith("375"):
+        return digits[3:]
+    if len(digits) == 11 and digits.startswith("80"):
+        return digits[2:]
+    if len(digits) == 11 and digits[0] in "78":
+        return digits[1:]
+    return digits
+
+
+def normalize_email(value) -> str:
+    if _is_missing(value):
+        return ""
+    return str(value).strip().lower()
+
+
+def normalize_name(value) -> str:
+    if _is_missing(value):
+        return ""
+    return " ".join(str(value).split()).lower()
+
+# Порядок важен: как и в check_duplicates, повтор ищется сначала по имени, затем по телефону и почте
+KEYS = (
+    ("Имя", normalize_name),
+    ("Телефон", normalize_phone),
+    ("Почта", normalize_email),
+)
+
+
+class DuplicateIndex:
+    def __init__(self, filename: str):
+        """
+        Постоянный индекс повторных регистраций.
+
+        Хранит нормализованные имя, телефон и e-mail всех уже проверенных
+        регистраций и итоговое примечание каждой из них, поэтому новую
+        запись можно проверить по всей истории за O(1), не перечитывая
+        старые письма, а "Первая"/"Повторная регистрация" не меняются от
+        запуска к запуску.
+
+        Args:
+            filename (str): Файл базы данных SQLite (":memory:" - индекс на один запуск).
+        """
+        # Индекс заполняется в потоке загрузки почты (run_account), а закрывается в основном потоке
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS seen (kind TEXT, value TEXT, reg_number TEXT, "
+            "PRIMARY KEY (kind, value)) WITHOUT ROWID"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS notes (reg_number TEXT PRIMARY KEY, note TEXT) WITHOUT ROWID"
+        )
+
+    @classmethod
+    def for_account(cls, mail_login: str) -> "DuplicateIndex":
+        return cls(DUPLICATE_INDEX_FILE.format(account=mail_login.split("@")[0]))
+
+    def note(self, reg_number) -> str:
+        """
+        Возвращает примечание уже проверенной регистрации или None.
+        """
+        row = self.connection.execute("SELECT note FROM notes WHERE reg_number = ?", (str(reg_number),)).fetchone()
+        return row[0] if row else None
+
+    def _set_note(self, reg_number: str, note: str) -> None:
+        self.connection.execute("INSERT OR REPLACE INTO notes VALUES (?, ?)", (reg_number, note))
+
+    def check(self, record: dict) -> str:
+        """
+        Проверяет регистрацию и записывает результат в record['Примечание'].
+
+        Уже проверенная регистрация получает сохраненное примечание. Для
+        новой повтор ищется по нормализованным ключам; совпавшая более ранняя
+        регистрация становится "Первой" - ее номер возвращается, чтобы
+        вызывающий код обновил уже выведенную строку.
+
+        Args:
+            record (dict): Данные регистрации.
+
+        Returns:
+            str: Регистрационный номер записи, отмеченной как "Первая регистрация", или None.
+        """
+        reg_number = str(record['Регистрационный номер'])
+        note = self.note(reg_number)
+        if note is not None:
+            record['Примечание'] = note
+            return None
+
+        first = None
+        for field, normalize in KEYS:
+            value = normalize(record[field])
+            if not value:
+                continue
+            row = self.connection.execute(
+                "SELECT reg_number FROM seen WHERE kind = ? AND value = ?", (field, value)
+            ).fetchone()
+            self.connection.execute("INSERT OR REPLACE INTO seen VALUES (?, ?, ?)", (field, value, reg_number))
+            if row:
+                first = row[0]
+                break
+
+        if first is None:
+            record['Примечание'] = ""
+        else:
+            record['Примечание'] = REPEAT_NOTE
+            self._set_note(first, FIRST_NOTE)
+        self._set_note(reg_number, record['Примечание'])
+        return first
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
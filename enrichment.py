@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+from html_report import CLOSED_NOTES, whatsapp_button
+
+CSV_HEADERS = ['Дата', 'Имя', 'Телефон', 'Почта', 'Регистрационный номер', 'Тип', 'Примечание']
+
+
+def team_note(note: str, reg_number, roster) -> str:
+    """
+    Дополняет примечание одной регистрации данными из TeamRoster.
+
+    Построчный вариант enrich для потоковой обработки: НОО, если он не
+    нулевой, или "Закрыто", если участника нет в команде.
+
+    Args:
+        note (str): Текущее примечание ("", "Первая/Повторная регистрация").
+        reg_number: Регистрационный номер.
+        roster (TeamRoster): Индексы выгрузки команды.
+
+    Returns:
+        str: Итоговое примечание.
+    """
+    reg_number = int(reg_number)
+    if reg_number in roster:
+        noo_value = roster.noo(reg_number)
+        if bool(int(noo_value)):
+            note += f" {noo_value}"
+    else:
+        note += " Закрыто"
+    return note.replace('.', ',').strip()
+
+
+def _team_noo(team: pd.DataFrame) -> pd.DataFrame:
+    """
+    Готовит из выгрузки команды таблицу "регистрационный номер -> НОО".
+
+    НОО переводится в строку до объединения, чтобы формат совпадал с
+    f"{noo_value}" исходного столбца (после левого объединения целые числа
+    превратились бы в float).
+    """
+    team_noo = team[["Регистрационный номер", "НОО"]].dropna(subset=["Регистрационный номер"])
+    team_noo = team_noo.drop_duplicates(subset="Регистрационный номер", keep="first")
+    return pd.DataFrame({
+        "_reg_number": team_noo["Регистрационный номер"].astype("int64").to_numpy(),
+        "_noo_text": team_noo["НОО"].astype(str).to_numpy(),
+        "_noo_nonzero": (np.trunc(team_noo["НОО"].astype(float)) != 0).to_numpy(),
+    })
+
+
+def enrich(data_list: list, team: pd.DataFrame) -> pd.DataFrame:
+    """
+    Дополняет регистрации данными из backoffice одним объединением таблиц.
+
+    Все записи обрабатываются операциями над столбцами: "Примечание"
+    получает НОО или "Закрыто", а для закрытых аккаунтов формируется
+    кнопка WhatsApp в столбце "Сообщение".
+
+    Args:
+        data_list (list): Список словарей с данными регистраций.
+        team (pandas.DataFrame): Выгрузка "Моя команда" из backoffice.
+
+    Returns:
+        pandas.DataFrame: Регистрации с заполненными "Примечание" и "Сообщение".
+    """
+    frame = pd.DataFrame(data_list, columns=CSV_HEADERS)
+    frame["_reg_number"] = frame["Регистрационный номер"].astype("int64")
+    merged = frame.merge(_team_noo(team), how="left", on="_reg_number", indicator=True)
+
+    notes = merged["Примечание"].fillna("")
+    found = (merged["_merge"] == "both").to_numpy()
+    # Строки без пары в выгрузке получают NaN; .eq(True) дает bool без приведения object-столбца
+    nonzero = merged["_noo_nonzero"].eq(True).to_numpy()
+    notes = pd.Series(
+        np.where(~found, notes + " Закрыто", np.where(nonzero, notes + " " + merged["_noo_text"].fillna(""), notes)),
+        index=merged.index,
+    )
+    merged["Примечание"] = notes.str.replace('.', ',', regex=False).str.strip()
+
+    closed = merged["Примечание"].isin(CLOSED_NOTES)
+    merged["Сообщение"] = pd.Series(
+        [whatsapp_button(name, phone) for name, phone in
+         zip(merged.loc[closed, "Имя"], merged.loc[closed, "Телефон"])],
+        index=merged.index[closed], dtype=object,
+    )
+
+    return merged[CSV_HEADERS + ["Сообщение"]]
+
+
+def write_csv(frame: pd.DataFrame, csv_filename: str) -> None:
+    """
+    Сохраняет регистрации в CSV (столбцы CSV_HEADERS, разделитель ";", UTF-8 с BOM).
+    """
+    frame.to_csv(csv_filename, sep=';', columns=CSV_HEADERS, index=False,
+                 encoding='utf-8-sig', lineterminator='\r\n')
@@ -0,0 +1,108 @@
+import sys
+import time
+from pathlib import Path
+
+from lxml import etree
+
+import config
+
+TAGS = ("h1", "h2", "p", "a")
+DEFAULT_ENGINE = getattr(config, "extraction_engine", "lxml")
+
+_HTML_PARSER = etree.HTMLParser(encoding="utf-8")
+
+
+def extract_strings_bs4(html: str) -> list:
+    """
+    Эталонное извлечение текстов тегов h1, h2, p и a через BeautifulSoup.
+
+    Args:
+        html (str): HTML-тело письма.
+
+    Returns:
+        list: Тексты элементов в порядке документа.
+    """
+    # BeautifulSoup загружается только для эталонного движка
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "lxml")
+    return [text.get_text(strip=True) for text in soup.find_all(list(TAGS))]
+
+
+def extract_strings_lxml(html: str) -> list:
+    """
+    Быстрое извлечение тех же текстов напрямую через lxml, без построения
+    дерева BeautifulSoup.
+
+    Результат совпадает с extract_strings_bs4: каждый текстовый узел внутри
+    элемента обрезается по краям, пустые отбрасываются, остальные склеиваются.
+
+    Args:
+        html (str): HTML-тело письма.
+
+    Returns:
+        list: Тексты элементов в порядке документа.
+    """
+    if not html:
+        return []
+    root = etree.fromstring(html.encode("utf-8"), _HTML_PARSER)
+    if root is None:
+        return []
+    return [
+        "".join(piece.strip() for piece in element.itertext())
+        for element in root.iter(*TAGS)
+    ]
+
+
+ENGINES = {
+    "bs4": extract_strings_bs4,
+    "lxml": extract_strings_lxml,
+}
+
+
+def extract_strings(html: str, engine: str = DEFAULT_ENGINE) -> list:
+    """
+    Извлекает тексты письма выбранным движком ("bs4" или "lxml").
+    """
+    return ENGINES[engine](html)
+
+
+def _load_letters(path: Path) -> list:
+    from imap_tools import MailMessage
+
+    letters = []
+    for file in sorted(path.iterdir()):
+        if file.suffix == ".eml":
+            letters.append(MailMessage.from_bytes(file.read_bytes()).html)
+        elif file.suffix in (".html", ".htm"):
+            letters.append(file.read_text(encoding="utf-8"))
+    return letters
+
+
+def compare_engines(letters: list) -> None:
+    """
+    Проверяет, что движки дают одинаковый результат, и сравнивает их скорость.
+
+    Args:
+        letters (list): HTML-тела писем.
+    """
+    results = {}
+    for name, engine in ENGINES.items():
+        started = time.perf_counter()
+        results[name] = [engine(html) for html in letters]
+        print(f"{name}: {time.perf_counter() - started:.3f} с на {len(letters)} писем")
+
+    mismatches = [
+        index
+        for index, (reference, fast) in enumerate(zip(results["bs4"], results["lxml"]))
+        if reference != fast
+    ]
+    if mismatches:
+        print(f"Расхождения в письмах: {mismatches}")
+        sys.exit(1)
+    print("Результаты движков совпадают")
+
+
+if __name__ == "__main__":
+    # python extractors.py <папка с письмами .eml/.html>
+    compare_engines(_load_letters(Path(sys.argv[1])))
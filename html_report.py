@@ -0,0 +1,180 @@
+import csv
+import glob
+import math
+import os
+from html import escape
+from urllib.parse import quote
+
+import config
+
+HTML_PAGE_SIZE = getattr(config, "html_page_size", 1000)
+# Страницы после первой: <имя>.page2.html, <имя>.page3.html...
+PAGE_SUFFIX = ".page"
+
+# Примечания закрытых аккаунтов: им в отчет добавляется кнопка WhatsApp
+CLOSED_NOTES = ['Закрыто', 'Повторная регистрация Закрыто']
+
+WHATSAPP_TEXT = (
+    ", добрый день! Ранее Вы регистрировались на сайте Siberian Wellness (Сибирское Здоровье). "
+    "Ваш аккаунт был удален в связи с отсутствием активности в течение продолжительного времени."
+    "Если вы захотите снова стать частью Siberian Wellness – просто зарегистрируйтесь по ссылке - "
+    "это бесплатно. "
+    "https://ru.siberianhealth.com/ru/shop/user/registration/PRIVILEGED_CLIENT/?referral=2596572021"
+)
+
+# Шаблон ссылки собирается один раз: постоянная часть текста уже закодирована,
+# для каждой записи подставляются только телефон и имя
+WHATSAPP_URL = ("https://api.whatsapp.com/send/?phone={phone}&text={name}"
+                + quote(WHATSAPP_TEXT).replace("{", "{{").replace("}", "}}")
+                + "&type=phone_number&app_absent=1")
+
+WHATSAPP_BUTTON = '<button><a href="{url}" target="_blank">Отправить</a></button>'
+
+HEADERS = ['Дата', 'Имя', 'Телефон', 'Почта', 'Регистрационный номер', 'Тип', 'Примечание', 'Сообщение']
+
+# Столбец с готовой разметкой (кнопка WhatsApp собирается с экранированием в whatsapp_button)
+MARKUP_COLUMNS = {'Сообщение'}
+
+PAGE_START = """<html>
+<head>
+    <meta charset="UTF-8">
+    <title>Данные{title_suffix}</title>
+    <style>
+        table {{
+            border-collapse: collapse;
+            width: 100%;
+        }}
+        th, td {{
+            border: 1px solid black;
+            padding: 8px;
+            text-align: left;
+        }}
+        th {{
+            background-color: #f2f2f2;
+        }}
+    </style>
+</head>
+<body>
+    <h1>Данные{title_suffix}</h1>
+    <table>
+        <thead>
+            <tr>{header_cells}</tr>
+        </thead>
+        <tbody>
+"""
+
+PAGE_END = """        </tbody>
+    </table>
+    {navigation}
+</body>
+</html>
+"""
+
+HEADER_CELLS = "".join(f"<th>{escape(header)}</th>" for header in HEADERS)
+
+
+def whatsapp_button(name: str, phone) -> str:
+    """
+    Возвращает HTML-кнопку со ссылкой на сообщение в WhatsApp для закрытого аккаунта.
+
+    Имя и телефон кодируются для URL, а ссылка экранируется для HTML,
+    поэтому кнопку можно вставлять в отчет без дополнительной обработки.
+    """
+    words = name.split() if isinstance(name, str) else []
+    # Пустой телефон приходит как None или NaN из столбца pandas
+    missing = phone is None or (isinstance(phone, float) and math.isnan(phone))
+    phone = "" if missing else str(phone)
+    url = WHATSAPP_URL.format(phone=quote(phone), name=quote(words[-1] if words else ""))
+    return WHATSAPP_BUTTON.format(url=escape(url))
+
+
+def iter_closed(csv_filename):
+    """
+    Построчно читает из CSV закрытые аккаунты и добавляет им кнопку WhatsApp.
+
+    Для каждого регистрационного номера учитывается только последняя строка:
+    в режиме --incremental-output (см. OutputStore) новая версия строки
+    дописывается в конец CSV, а прежняя остается. Номера последних строк
+    собираются первым проходом по файлу, записи читаются вторым.
+    """
+    with open(csv_filename, newline='', encoding='utf-8-sig') as file:
+        last_rows = {row['Регистрационный номер']: number
+                     for number, row in enumerate(csv.DictReader(file, delimiter=';'))}
+    with open(csv_filename, newline='', encoding='utf-8-sig') as file:
+        for number, row in enumerate(csv.DictReader(file, delimiter=';')):
+            if row['Примечание'] in CLOSED_NOTES and last_rows[row['Регистрационный номер']] == number:
+                row['Сообщение'] = whatsapp_button(row['Имя'], row['Телефон'])
+                yield row
+
+
+def page_filename(html_filename: str, page: int) -> str:
+    """
+    Первая страница сохраняется под исходным именем, остальные - как name.page2.html, name.page3.html...
+
+    Суффикс через точку не совпадает с отчетом другого ящика: в пакетном
+    режиме рядом лежат leader.html и leader_2.html разных аккаунтов.
+    """
+    if page == 1:
+        return html_filename
+    root, ext = os.path.splitext(html_filename)
+    return f"{root}{PAGE_SUFFIX}{page}{ext}"
+
+
+def _row_html(data: dict) -> str:
+    cells = []
+    for header in HEADERS:
+        value = data.get(header)
+        value = "" if value is None else str(value)
+        cells.append(f"<td>{value if header in MARKUP_COLUMNS else escape(value)}</td>")
+    return f"            <tr>{''.join(cells)}</tr>\n"
+
+
+def _navigation(html_filename: str, page: int, has_next: bool) -> str:
+    links = []
+    if page > 1:
+        links.append(f'<a href="{escape(os.path.basename(page_filename(html_filename, page - 1)))}">← Назад</a>')
+    links.append(f"Страница {page}")
+    if has_next:
+        links.append(f'<a href="{escape(os.path.basename(page_filename(html_filename, page + 1)))}">Далее →</a>')
+    return f"<p>{' | '.join(links)}</p>"
+
+
+def write_html_report(data_list, html_filename: str, page_size: int = HTML_PAGE_SIZE) -> int:
+    """
+    Потоково записывает HTML-отчет, разбивая его на страницы по page_size строк.
+
+    Строки пишутся в файл сразу, без накопления страницы в памяти; все
+    значения, кроме готовой разметки кнопки, экранируются. Страницы связаны
+    ссылками "Назад"/"Далее", лишние страницы от прошлых запусков удаляются.
+    В отчет попадают только записи со столбцом "Сообщение".
+
+    Args:
+        data_list: Итерируемый источник словарей с данными.
+        html_filename (str): Имя первой страницы.
+        page_size (int): Количество строк на странице.
+
+    Returns:
+        int: Количество страниц.
+    """
+    rows = (data for data in data_list if data.get('Сообщение') is not None)
+    current = next(rows, None)
+    page = 0
+    while page == 0 or current is not None:
+        page += 1
+        title_suffix = f" (страница {page})" if page > 1 else ""
+        with open(page_filename(html_filename, page), 'w', encoding='utf-8') as file:
+            file.write(PAGE_START.format(title_suffix=title_suffix, header_cells=HEADER_CELLS))
+            written = 0
+            while current is not None and written < page_size:
+                file.write(_row_html(current))
+                written += 1
+                current = next(rows, None)
+            file.write(PAGE_END.format(navigation=_navigation(html_filename, page, current is not None)))
+
+    root, ext = os.path.splitext(html_filename)
+    prefix = f"{root}{PAGE_SUFFIX}"
+    for stale in glob.glob(f"{glob.escape(prefix)}*{ext}"):
+        suffix = stale[len(prefix):-len(ext) if ext else None]
+        if suffix.isdigit() and int(suffix) > page:
+            os.remove(stale)
+    return page
@@ -0,0 +1,122 @@
+import re
+from bisect import bisect_right
+
+import config
+
+EMAIL_PATTERN = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
+# Белорусский номер (375 и 9 цифр) проверяется раньше 11 цифр, иначе от него берутся только первые 11
+PHONE_PATTERN = r'375\d{9}|\d{11}'
+
+# Поля, которые ищутся во всем письме: берется первое совпадение. Третий элемент - символы,
+# с которых может начинаться совпадение (по ним поиск быстро пропускает остальной текст).
+# Почта проверяется раньше телефона, чтобы цифры из адреса не принимались за номер.
+FIELDS = (
+    ("Почта", EMAIL_PATTERN, r"A-Za-z0-9._%+\-"),
+    ("Телефон", PHONE_PATTERN, r"\d"),
+)
+
+# Уровни регистрации в порядке приоритета (если в письме упомянуты оба, выбирается первый)
+TIERS = ("Бизнес-Партнер", "Привилегированный клиент")
+
+# Тексты письма соединяются через пробел: ни одно поле, кроме уровня, не может его содержать,
+# а уровень, как и раньше, ищется в тексте, склеенном через пробел
+SEPARATOR = " "
+
+
+class LetterTemplate:
+    def __init__(self, name: str, marker: str, name_offset: int = -1):
+        """
+        Шаблон письма о регистрации.
+
+        Args:
+            name (str): Название шаблона.
+            marker (str): Подпись строки с регистрационным номером (номер идет после последнего ":").
+            name_offset (int): Смещение строки с именем относительно строки с номером.
+        """
+        self.name = name
+        self.marker = marker
+        self.name_offset = name_offset
+
+
+TEMPLATES = [
+    LetterTemplate("registration", "Регистрационный номер:"),
+    LetterTemplate("agreement", "Номер Соглашения:"),
+]
+# Дополнительные шаблоны из config.py: [{"name": ..., "marker": ..., "name_offset": -1}, ...]
+TEMPLATES += [LetterTemplate(**template) for template in getattr(config, "letter_templates", [])]
+
+
+class RegistrationExtractor:
+    def __init__(self, templates=TEMPLATES, fields=FIELDS, tiers=TIERS):
+        """
+        Извлекает поля регистрации из текстов письма за один проход.
+
+        Подписи шаблонов, поля и уровни один раз собираются в общее регулярное
+        выражение с именованными группами; для письма выполняется один поиск
+        по склеенному тексту, и каждое совпадение по имени группы относится
+        к своему правилу. Новый шаблон письма - это новая запись в templates,
+        цикл разбора при этом не меняется.
+
+        Args:
+            templates (list): Шаблоны LetterTemplate; при нескольких подписях в письме выбирается первая по тексту.
+            fields (tuple): Тройки (название поля, регулярное выражение без именованных групп,
+                символы для [...], с которых начинается совпадение).
+            tiers (tuple): Уровни регистрации в порядке приоритета.
+        """
+        self.templates = {f"template_{i}": template for i, template in enumerate(templates)}
+        self.fields = {f"field_{i}": field for i, (field, _, _) in enumerate(fields)}
+        self.tiers = {f"tier_{i}": (i, tier) for i, tier in enumerate(tiers)}
+        literals = [template.marker for template in templates] + list(tiers)
+        alternatives = (
+            [f"(?P<{group}>{re.escape(template.marker)})" for group, template in self.templates.items()]
+            + [f"(?P<field_{i}>{pattern})" for i, (_, pattern, _) in enumerate(fields)]
+            + [f"(?P<{group}>{re.escape(tier)})" for group, (_, tier) in self.tiers.items()]
+        )
+        # Проверка первого символа отсекает позиции, с которых не начинается ни одно правило,
+        # не перебирая все альтернативы
+        first_chars = "".join(re.escape(literal[0]) for literal in literals)
+        first_chars += "".join(chars for _, _, chars in fields)
+        self.pattern = re.compile(f"(?=[{first_chars}])(?:{'|'.join(alternatives)})")
+
+    def extract(self, strings: list) -> dict:
+        """
+        Args:
+            strings (list): Тексты письма в порядке документа.
+
+        Returns:
+            dict: 'Имя', 'Регистрационный номер', 'Телефон', 'Почта', 'Тип' или
+                None, если в письме нет строки с регистрационным номером.
+        """
+        starts = []
+        position = 0
+        for string in strings:
+            starts.append(position)
+            position += len(string) + len(SEPARATOR)
+        text = SEPARATOR.join(strings)
+
+        index = template = None
+        found = {}
+        tier = None
+        for match in self.pattern.finditer(text):
+            group = match.lastgroup
+            if group in self.templates:
+                if template is None:
+                    template = self.templates[group]
+                    index = bisect_right(starts, match.start()) - 1
+            elif group in self.fields:
+                found.setdefault(self.fields[group], match.group())
+            elif tier is None or self.tiers[group][0] < tier[0]:
+                tier = self.tiers[group]
+
+        if template is None:
+            return None
+        return {
+            'Имя': strings[index + template.name_offset],
+            'Регистрационный номер': strings[index].split(':')[-1].strip(),
+            'Телефон': found.get('Телефон'),
+            'Почта': found.get('Почта'),
+            'Тип': tier[1] if tier else None,
+        }
+
+
+EXTRACTOR = RegistrationExtractor()
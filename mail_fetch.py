@@ -0,0 +1,264 @@
+import json
+import os
+from urllib.parse import urlsplit
+
+from imap_tools import AND, MailBox, MailBoxUnencrypted, U
+
+import config
+from metrics import METRICS
+from pipeline import buffered
+
+STATE_FILE = getattr(config, "mail_state_file", "mail_state.json")
+REGISTRATION_SUBJECT = "Siberian Wellness: новая регистрация в вашей команде!"
+REGISTRATION_SENDER = getattr(config, "registration_sender", None)
+FETCH_CHUNK_SIZE = 500
+# По умолчанию папка загружается по одному подключению; больше - только по явной настройке
+SYNC_CONNECTIONS = getattr(config, "initial_sync_connections", 1)
+SYNC_BUFFER_SIZE = getattr(config, "initial_sync_buffer_size", 200)
+
+
+def connect(mail_server: str):
+    """
+    Создает подключение imap_tools к серверу почты.
+
+    Адрес "imap.example.com" или "imaps://imap.example.com:993" - подключение
+    по SSL; "imap://127.0.0.1:1143" - без шифрования (например, к локальному
+    стенду bench.py).
+
+    Returns:
+        BaseMailBox: Неавторизованное подключение.
+    """
+    if "://" not in mail_server:
+        return MailBox(mail_server)
+    address = urlsplit(mail_server)
+    if address.scheme == "imap":
+        return MailBoxUnencrypted(address.hostname, address.port or 143)
+    return MailBox(address.hostname, address.port or 993)
+
+
+class UidState:
+    def __init__(self, filename: str = STATE_FILE):
+        """
+        Хранилище водяных знаков (UIDVALIDITY + последний UID) по ящикам и папкам.
+
+        Args:
+            filename (str): JSON-файл, в котором сохраняется состояние.
+        """
+        self.filename = filename
+        self._state = {}
+        if os.path.exists(filename):
+            with open(filename, encoding="utf-8") as file:
+                self._state = json.load(file)
+
+    @staticmethod
+    def _key(account: str, folder: str) -> str:
+        return f"{account}/{folder}"
+
+    def get(self, account: str, folder: str) -> tuple:
+        """
+        Возвращает сохраненные UIDVALIDITY и последний UID папки.
+
+        Returns:
+            tuple: (uidvalidity или None, last_uid).
+        """
+        entry = self._state.get(self._key(account, folder), {})
+        return entry.get("uidvalidity"), entry.get("last_uid", 0)
+
+    def set(self, account: str, folder: str, uidvalidity: int, last_uid: int) -> None:
+        entry = self._state.setdefault(self._key(account, folder), {})
+        entry["uidvalidity"] = uidvalidity
+        entry["last_uid"] = last_uid
+
+    def bind_store(self, account: str, folder: str, generation: str) -> None:
+        """
+        Сбрасывает водяной знак папки, если он сохранен для другого поколения хранилища писем.
+
+        Хранилище пересоздается при смене RegistrationStore.SCHEMA_VERSION или
+        удалении файла; без сброса уже обработанные письма больше не были бы
+        загружены, и история регистраций пропала бы из отчета. Сброс, как и
+        обычный водяной знак, попадает на диск только при save().
+        """
+        key = self._key(account, folder)
+        if self._state.get(key, {}).get("store_generation") != generation:
+            self._state[key] = {"uidvalidity": None, "last_uid": 0, "store_generation": generation}
+
+    def save(self) -> None:
+        """
+        Атомарно записывает состояние на диск.
+        """
+        tmp_filename = f"{self.filename}.tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as file:
+            json.dump(self._state, file, ensure_ascii=False, indent=2)
+        os.replace(tmp_filename, self.filename)
+
+
+def search_criteria(subject: str = REGISTRATION_SUBJECT, sender: str = REGISTRATION_SENDER, last_uid: int = 0):
+    """
+    Формирует критерий IMAP SEARCH для писем о регистрации.
+
+    SUBJECT в IMAP ищет подстроку, поэтому точное совпадение темы
+    проверяется уже по заголовкам.
+
+    Args:
+        subject (str): Тема письма.
+        sender (str): Адрес отправителя или None.
+        last_uid (int): Последний обработанный UID.
+
+    Returns:
+        AND: Критерий поиска.
+    """
+    params = {"subject": subject}
+    if sender:
+        params["from_"] = sender
+    if last_uid:
+        params["uid"] = U(last_uid + 1, "*")
+    return AND(**params)
+
+
+def _chunks(items: list, size: int = FETCH_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def fetch_registrations(mailbox, account: str, folder: str, state: UidState = None,
+                        subject: str = REGISTRATION_SUBJECT, sender: str = REGISTRATION_SENDER,
+                        limit: int = None, bulk: bool = False, body_chunk_size: int = FETCH_CHUNK_SIZE):
+    """
+    Выбирает из папки письма о регистрации.
+
+    Фильтр по теме и отправителю выполняется на сервере через IMAP SEARCH,
+    затем загружаются только заголовки найденных писем (BODY.PEEK[HEADER]),
+    и полные письма скачиваются лишь для UID с точным совпадением темы.
+
+    Если передан state, выбираются только письма новее сохраненного
+    водяного знака. При смене UIDVALIDITY старые UID недействительны,
+    поэтому папка перечитывается целиком. Водяной знак обновляется в state
+    только после того, как генератор полностью исчерпан; на диск его
+    записывает вызывающий код вызовом state.save().
+
+    Args:
+        mailbox: Авторизованный imap_tools.MailBox.
+        account (str): Логин почты (ключ состояния).
+        folder (str): Название папки.
+        state (UidState): Хранилище водяных знаков или None.
+        subject (str): Тема писем о регистрации.
+        sender (str): Адрес отправителя или None.
+        limit (int): Максимальное количество писем за запуск.
+        bulk (bool): Загружать тела писем одной командой на порцию.
+        body_chunk_size (int): Размер порции писем при загрузке тел.
+
+    Yields:
+        MailMessage: Письма о регистрации в порядке возрастания UID.
+    """
+    uidvalidity, last_uid, uids = _search_uids(mailbox, account, folder, state, subject, sender)
+    uids = uids[:limit]
+
+    yield from _fetch_matching(mailbox, uids, subject, bulk, body_chunk_size)
+
+    if state is not None:
+        state.set(account, folder, uidvalidity, int(uids[-1]) if uids else last_uid)
+
+
+def _search_uids(mailbox, account: str, folder: str, state: UidState, subject: str, sender: str) -> tuple:
+    """
+    Ищет UID писем о регистрации новее водяного знака.
+
+    Returns:
+        tuple: (uidvalidity, last_uid, отсортированный список UID).
+    """
+    mailbox.folder.set(folder)
+    uidvalidity, last_uid = None, 0
+    if state is not None:
+        uidvalidity = mailbox.folder.status(folder, ["UIDVALIDITY"])["UIDVALIDITY"]
+        saved_uidvalidity, last_uid = state.get(account, folder)
+        if saved_uidvalidity != uidvalidity:
+            last_uid = 0
+
+    # Диапазон "N:*" всегда содержит последнее письмо папки, даже если его UID меньше N
+    uids = sorted(
+        (uid for uid in mailbox.uids(search_criteria(subject, sender, last_uid), charset="UTF-8")
+         if int(uid) > last_uid),
+        key=int,
+    )
+    return uidvalidity, last_uid, uids
+
+
+def _fetch_matching(mailbox, uids: list, subject: str, bulk: bool, body_chunk_size: int):
+    """
+    Загружает заголовки писем uids и полные письма для тех, чья тема совпадает точно.
+    """
+    for chunk in _chunks(uids):
+        matched = [
+            msg.uid
+            for msg in mailbox.fetch(AND(uid=chunk), mark_seen=False, headers_only=True, bulk=True)
+            if msg.subject == subject
+        ]
+        METRICS.count("imap_headers", len(chunk))
+        for body_chunk in _chunks(matched, body_chunk_size):
+            for msg in mailbox.fetch(AND(uid=body_chunk), mark_seen=False, bulk=bulk):
+                METRICS.count("imap_messages")
+                METRICS.count("imap_bytes", msg.size_rfc822)
+                yield msg
+
+
+def _fetch_shard(mail_server: str, mail_login: str, mail_password: str, folder: str, uids: list,
+                 subject: str, body_chunk_size: int):
+    with connect(mail_server).login(mail_login, mail_password) as mailbox:
+        mailbox.folder.set(folder)
+        yield from _fetch_matching(mailbox, uids, subject, True, body_chunk_size)
+
+
+def fetch_registrations_sharded(mail_server: str, mail_login: str, mail_password: str, folder: str,
+                                state: UidState = None, connections: int = SYNC_CONNECTIONS,
+                                subject: str = REGISTRATION_SUBJECT, sender: str = REGISTRATION_SENDER,
+                                limit: int = None, body_chunk_size: int = FETCH_CHUNK_SIZE,
+                                buffer_size: int = SYNC_BUFFER_SIZE):
+    """
+    Параллельная первичная загрузка большой папки по нескольким подключениям.
+
+    Найденные UID делятся на непрерывные диапазоны (не меньше body_chunk_size
+    писем), каждый загружается по своему подключению в фоновом потоке.
+    Результаты выдаются в порядке возрастания UID: сначала первый диапазон,
+    затем второй и т.д.; остальные диапазоны тем временем накапливаются в
+    буферах размером buffer_size. Если диапазон один, письма загружаются по
+    тому же подключению, что и поиск.
+
+    Args:
+        mail_server (str): Сервер почты.
+        mail_login (str): Логин для почты (ключ состояния).
+        mail_password (str): Пароль для почты.
+        folder (str): Название папки.
+        state (UidState): Хранилище водяных знаков или None.
+        connections (int): Максимум одновременных подключений к серверу.
+        subject (str): Тема писем о регистрации.
+        sender (str): Адрес отправителя или None.
+        limit (int): Максимальное количество писем за запуск, как в fetch_registrations.
+        body_chunk_size (int): Размер порции писем при загрузке тел.
+        buffer_size (int): Размер буфера каждого диапазона.
+
+    Yields:
+        MailMessage: Письма о регистрации в порядке возрастания UID.
+    """
+    with connect(mail_server).login(mail_login, mail_password) as mailbox:
+        uidvalidity, last_uid, uids = _search_uids(mailbox, mail_login, folder, state, subject, sender)
+        uids = uids[:limit]
+        shard_size = max(body_chunk_size, -(-len(uids) // max(connections, 1)))
+        shards = list(_chunks(uids, shard_size))
+        if len(shards) <= 1:
+            yield from _fetch_matching(mailbox, uids, subject, True, body_chunk_size)
+
+    if len(shards) > 1:
+        streams = [
+            buffered(_fetch_shard(mail_server, mail_login, mail_password, folder, shard, subject, body_chunk_size),
+                     buffer_size)
+            for shard in shards
+        ]
+        try:
+            for stream in streams:
+                yield from stream
+        finally:
+            for stream in streams:
+                stream.close()
+
+    if state is not None:
+        state.set(mail_login, folder, uidvalidity, int(uids[-1]) if uids else last_uid)
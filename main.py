@@ -1,222 +1,360 @@
 import csv
-import re
-from datetime import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from itertools import chain
 
-from bs4 import BeautifulSoup
-from imap_tools import MailBox
 from tqdm import tqdm
 
 import config
-from backoffice import backoffice
+from backoffice import load_team
+from duplicate_index import FIRST_NOTE, DuplicateIndex
+from enrichment import CSV_HEADERS, enrich, team_note, write_csv
+from extractors import DEFAULT_ENGINE, extract_strings
+from html_report import iter_closed, write_html_report
+from letter_rules import EXTRACTOR
+from mail_fetch import REGISTRATION_SUBJECT, connect, fetch_registrations, fetch_registrations_sharded
+from metrics import METRICS
+from output_store import OutputStore
+from pipeline import buffered, chunked, dedupe_stream, run_concurrently
+from team import TeamRoster
 
 
-def extract_tier(text_list: list) -> str:
+STREAM_CHUNK_SIZE = getattr(config, "stream_chunk_size", 100)
+STREAM_BUFFER_SIZE = getattr(config, "stream_buffer_size", 500)
+
+
+def parse_registration(html, date, engine=DEFAULT_ENGINE):
     """
-    Извлекает уровень (тип) регистрации из списка текстов.
+    Извлекает данные регистрации из HTML-тела письма.
+
+    Принимает только строки, а не MailMessage, чтобы функцию можно было
+    выполнять в пуле процессов.
 
     Args:
-        text_list (list): Список строк с текстом письма.
+        html (str): HTML-тело письма.
+        date (str): Дата письма в формате ГГГГ-ММ-ДД.
+        engine (str): Движок извлечения текста ("bs4" или "lxml").
 
     Returns:
-        str: Уровень регистрации, если найден, иначе None.
-    """
-    text = ' '.join(text_list)
-    if "Бизнес-Партнер" in text:
-        return "Бизнес-Партнер"
-    elif "Привилегированный клиент" in text:
-        return "Привилегированный клиент"
-    return None
-
-def find_index(row):
-    """
-    Находит индекс первого элемента в списке row, который содержит подстроку
-    "Регистрационный номер:" или "Номер Соглашения:". Возвращает индекс или None, если не найдено.
-    """
-    search_terms = ("Регистрационный номер:", "Номер Соглашения:")
-
-    for idx, item in enumerate(row):
-        if any(term in item for term in search_terms):
-            return idx
-    return False
-
-def process_message(msg):
-    email_pattern = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
-    phone_pattern = re.compile(r'\d{11}|375\d{9}')
-
-    if msg.subject == "Siberian Wellness: новая регистрация в вашей команде!":
-        soup = BeautifulSoup(msg.html, 'lxml')
-        strings = [text.get_text(strip=True) for text in soup.find_all(["h1", "h2", "p", "a"])]
-        index = find_index(strings)
-
-        # Оптимизация прохода по строкам
-        emails = []
-        phones = []
-
-        for string in strings:
-            email_match = email_pattern.search(string)
-            if email_match:
-                emails.append(email_match.group(0))
-
-            phone_match = phone_pattern.search(string)
-            if phone_match:
-                phones.append(phone_match.group(0))
-
-        if isinstance(index, int):
-            data_row = {
-                'Дата': str(msg.date)[:10],
-                'Имя': strings[index-1],
-                'Регистрационный номер': strings[index].split(':')[-1].strip(),
-                'Телефон': phones[0] if phones else None,
-                'Почта': emails[0] if emails else None,
-                'Тип': extract_tier(strings),
-                'Примечание': ""
-            }
-            return data_row
-    return None
+        dict: Данные регистрации или None, если письмо не распознано.
+    """
+    data_row = EXTRACTOR.extract(extract_strings(html, engine))
+    if data_row is None:
+        return None
+    return {'Дата': date, **data_row, 'Примечание': ""}
 
 
 def fetch_emails(mail_server=config.mail_server,
                  mail_login=config.mail_login,
                  mail_password=config.mail_password,
-                 mailbox_name=config.mailbox):
-    with MailBox(mail_server).login(mail_login, mail_password) as mailbox:
-        mailbox.folder.set(mailbox_name)
-        messages = list(tqdm(mailbox.fetch(limit=1000), desc="fetch_emails"))
+                 mailbox_name=config.mailbox,
+                 state=None,
+                 connections=1):
+    with METRICS.stage("fetch_emails") as stage:
+        if connections > 1:
+            fetched = fetch_registrations_sharded(mail_server, mail_login, mail_password, mailbox_name, state,
+                                                  connections=connections, limit=1000)
+            messages = list(tqdm(fetched, desc="fetch_emails"))
+        else:
+            with connect(mail_server).login(mail_login, mail_password) as mailbox:
+                fetched = fetch_registrations(mailbox, mail_login, mailbox_name, state, limit=1000)
+                messages = list(tqdm(fetched, desc="fetch_emails"))
+        stage.add(len(messages))
 
     return messages
 
 
-def save_to_csv(data_list, csv_filename):
-    headers = ['Дата', 'Имя', 'Телефон', 'Почта', 'Регистрационный номер', 'Тип', 'Примечание']
+def check_duplicates(data, duplicates=None):
+    """
+    Отмечает первые и повторные регистрации через DuplicateIndex.
 
-    with open(csv_filename, mode='w', newline='', encoding='utf-8-sig') as file:
-        writer = csv.DictWriter(file, fieldnames=headers, delimiter=';')
-        writer.writeheader()
-        for data in data_list:
-            writer.writerow(data)
-
-def check_duplicates(data):
-    unique = dict()
-    for index, element in enumerate(tqdm(data, desc="check_duplicates")):
-        for key in ['Имя', 'Телефон', 'Почта']:
-            try:
-                if element[key] and element[key] in unique:
-                    element['Примечание'] = "Повторная регистрация"
-                    data[unique[element[key]]]['Примечание'] = f"Первая регистрация"
-                    break
-            finally:
-                unique[element[key]] = index
+    Args:
+        data (list): Регистрации в порядке получения.
+        duplicates (DuplicateIndex): Постоянный индекс аккаунта. Если не
+            задан, повторы ищутся только внутри data.
+
+    Returns:
+        list: Те же записи с заполненным "Примечание".
+    """
+    index = duplicates or DuplicateIndex(":memory:")
+    by_reg_number = dict()
+    with METRICS.stage("check_duplicates") as stage:
+        for element in tqdm(data, desc="check_duplicates"):
+            by_reg_number.setdefault(str(element['Регистрационный номер']), []).append(element)
+            first = index.check(element)
+            for earlier in by_reg_number.get(first, []):
+                earlier['Примечание'] = FIRST_NOTE
+        index.commit()
+        stage.add(len(data))
     return data
 
-def process_messages(messages):
-    processed_messages = []
-    for msg in tqdm(messages, desc="process_messages"):
-        result = process_message(msg)
-        if result:
-            processed_messages.append(result)
-    return processed_messages
-
-
-def update_my_team(list_of_dicts, df):
-    for item in tqdm(list_of_dicts, desc="update_my_team"):
-        reg_number = int(item["Регистрационный номер"])
-        if reg_number in df["Регистрационный номер"].values:
-            noo_value = df.loc[df["Регистрационный номер"] == reg_number, "НОО"].values[0]
-            if bool(int(noo_value)):
-                item["Примечание"] += f" {noo_value}"
+def process_messages(messages, store=None, workers=1, engine=DEFAULT_ENGINE):
+    """
+    Разбирает письма о регистрации, пропуская уже сохраненные в store.
+
+    При workers > 1 HTML-тела писем разбираются в пуле процессов порциями;
+    результаты возвращаются в исходном порядке писем, чтобы check_duplicates
+    отмечал первую регистрацию на нужной записи.
+
+    Args:
+        messages (list): Список MailMessage.
+        store (RegistrationStore): Хранилище разобранных писем или None.
+        workers (int): Количество процессов для разбора.
+        engine (str): Движок извлечения текста ("bs4" или "lxml").
+
+    Returns:
+        list: Данные регистраций в порядке писем.
+    """
+    with METRICS.stage("process_messages") as stage:
+        results = []
+        pending = []
+        for msg in messages:
+            key = store.message_key(msg) if store is not None else None
+            result = store.get(key) if store is not None else None
+            if store is not None:
+                METRICS.count("registration_store_hits" if result is not None else "registration_store_misses")
+            if result is None and msg.subject == REGISTRATION_SUBJECT:
+                pending.append((len(results), key, msg.html, str(msg.date)[:10]))
+            results.append(result)
+
+        htmls = [html for _, _, html, _ in pending]
+        dates = [date for _, _, _, date in pending]
+        parse = partial(parse_registration, engine=engine)
+        if workers > 1 and len(pending) > 1:
+            chunksize = max(1, len(pending) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                parsed = list(tqdm(executor.map(parse, htmls, dates, chunksize=chunksize),
+                                   total=len(pending), desc="process_messages"))
         else:
-            item["Примечание"] += " Закрыто"
-        item["Примечание"] = item["Примечание"].replace('.', ',').strip()
-    return list_of_dicts
+            parsed = [parse(html, date)
+                      for html, date in tqdm(zip(htmls, dates), total=len(pending), desc="process_messages")]
+
+        for (index, key, _, _), result in zip(pending, parsed):
+            results[index] = result
+            if result and store is not None:
+                store.put(key, result)
+        if store is not None:
+            store.commit()
+        stage.add(len(pending))
+    return [result for result in results if result]
 
 
 def save_to_html(data_list, html_filename):
-    headers = ['Дата', 'Имя', 'Телефон', 'Почта', 'Регистрационный номер', 'Тип', 'Примечание', 'Сообщение']
-
-    html_content = """
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <title>Данные</title>
-        <style>
-            table {
-                border-collapse: collapse;
-                width: 100%;
-            }
-            th, td {
-                border: 1px solid black;
-                padding: 8px;
-                text-align: left;
-            }
-            th {
-                background-color: #f2f2f2;
-            }
-        </style>
-    </head>
-    <body>
-        <h1>Данные</h1>
-        <table>
-            <thead>
-                <tr>
-    """
-
-    for header in headers:
-        html_content += f"<th>{header}</th>"
-
-    html_content += """
-                </tr>
-            </thead>
-            <tbody>
-    """
-
-    for data in data_list:
-        if 'Сообщение' in data:
-            html_content += "<tr>"
-            for header in headers:
-                html_content += f"<td>{data.get(header, '')}</td>"
-            html_content += "</tr>"
-
-    html_content += """
-            </tbody>
-        </table>
-    </body>
-    </html>
-    """
-
-    with open(html_filename, 'w', encoding='utf-8') as file:
-        file.write(html_content)
-
-def add_button_to_closed(data_list):
-    for data in data_list:
-        if data.get('Примечание') in ['Закрыто', 'Повторная регистрация Закрыто']:
-            text = f"{data['Имя'].split()[-1].strip()}, " \
-                   f"добрый день! Ранее Вы регистрировались на сайте Siberian Wellness (Сибирское Здоровье). " \
-                   f"Ваш аккаунт был удален в связи с отсутствием активности в течение продолжительного времени." \
-                   f"Если вы захотите снова стать частью Siberian Wellness – просто зарегистрируйтесь по ссылке - " \
-                   f"это бесплатно. " \
-                   f"https://ru.siberianhealth.com/ru/shop/user/registration/PRIVILEGED_CLIENT/?referral=2596572021"
-
-            url = f"https://api.whatsapp.com/send/?phone={data['Телефон']}&text={text}&type=phone_number&app_absent=1"
-
-            data['Сообщение'] = f'<button>' \
-                                f'<a href="{url}"' \
-                                f'target="_blank">Отправить</a>' \
-                                f'</button>'
+    """
+    Сохраняет записи с кнопкой WhatsApp в постраничный HTML-отчет (см. html_report).
+    """
+    with METRICS.stage("save_to_html"):
+        write_html_report(data_list, html_filename)
 
 
-if __name__ == '__main__':
-    messages = fetch_emails()
+def run_account(mail_server, mail_login, mail_password, mailbox_name, user, uid_state, store,
+                workers=1, engine=DEFAULT_ENGINE, imap_slots=None, connections=1, incremental_output=False):
+    """
+    Полный цикл обработки одного аккаунта: почта и backoffice параллельно,
+    затем обогащение и сохранение CSV/HTML с именем по логину почты.
+
+    Args:
+        mail_server, mail_login, mail_password, mailbox_name: Параметры почтового ящика.
+        user (dict): Номер и пароль для backoffice.
+        uid_state (UidState): Хранилище водяных знаков UID.
+        store (RegistrationStore): Хранилище разобранных писем аккаунта.
+        workers (int): Количество процессов для разбора писем.
+        engine (str): Движок извлечения текста.
+        imap_slots: Семафор, ограничивающий одновременные подключения к IMAP.
+        connections (int): Количество подключений для параллельной загрузки папки.
+        incremental_output (bool): Не переписывать CSV, а дописывать только
+            новые и изменившиеся строки (см. OutputStore).
+
+    Returns:
+        pandas.DataFrame: Обогащенные регистрации.
+    """
+    # Письма, загруженные для прежнего поколения хранилища, перечитываются заново
+    uid_state.bind_store(mail_login, mailbox_name, store.generation)
+
+    def collect_registrations():
+        with imap_slots or nullcontext():
+            messages = fetch_emails(mail_server, mail_login, mail_password, mailbox_name, state=uid_state,
+                                    connections=connections)
+        process_messages(messages, store, workers=workers, engine=engine)
+        duplicates = DuplicateIndex.for_account(mail_login)
+        try:
+            return check_duplicates(store.records(), duplicates)
+        finally:
+            duplicates.close()
+
+    results = run_concurrently(registrations=collect_registrations, team=partial(load_team, user))
+    with METRICS.stage("enrich") as stage:
+        report = enrich(results["registrations"], results["team"])
+        stage.add(len(report))
+
+    with METRICS.stage("write_csv") as stage:
+        if incremental_output:
+            output_store = OutputStore.for_account(mail_login)
+            stage.add(output_store.append_to_csv(report, f'{mail_login.split("@")[0]}.csv'))
+            output_store.close()
+        else:
+            write_csv(report, f'{mail_login.split("@")[0]}.csv')
+            stage.add(len(report))
+
+    closed = report[report['Сообщение'].notna()]
+    save_to_html((dict(zip(closed.columns, row)) for row in closed.itertuples(index=False, name=None)),
+                 f'{mail_login.split("@")[0]}.html')
+    return report
+
+
+def iter_emails(mail_server=config.mail_server,
+                mail_login=config.mail_login,
+                mail_password=config.mail_password,
+                mailbox_name=config.mailbox,
+                state=None,
+                chunk_size=STREAM_CHUNK_SIZE,
+                connections=1):
+    """
+    Потоковый вариант fetch_emails: письма загружаются порциями по chunk_size
+    (одной командой на порцию, без отметки о прочтении) и сразу передаются дальше.
+    При connections > 1 папка загружается параллельно по нескольким подключениям.
+    """
+    if connections > 1:
+        yield from fetch_registrations_sharded(mail_server, mail_login, mail_password, mailbox_name, state,
+                                               connections=connections, body_chunk_size=chunk_size)
+        return
+
+    with connect(mail_server).login(mail_login, mail_password) as mailbox:
+        yield from fetch_registrations(mailbox, mail_login, mailbox_name, state,
+                                       bulk=True, body_chunk_size=chunk_size)
 
-    data_list = process_messages(messages)
 
-    check_duplicates(data_list)
+def iter_new_records(messages, store, workers=1, engine=DEFAULT_ENGINE, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Потоковый вариант process_messages: разбирает письма порциями и выдает
+    только новые записи (уже сохраненные в store пропускаются).
+    """
+    parse = partial(parse_registration, engine=engine)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for chunk in chunked(messages, chunk_size):
+            with METRICS.stage("process_messages") as stage:
+                pending = [(store.message_key(msg), msg) for msg in chunk if msg.subject == REGISTRATION_SUBJECT]
+                known = len(pending)
+                pending = [(key, msg) for key, msg in pending if store.get(key) is None]
+                METRICS.count("registration_store_hits", known - len(pending))
+                METRICS.count("registration_store_misses", len(pending))
+                htmls = [msg.html for _, msg in pending]
+                dates = [str(msg.date)[:10] for _, msg in pending]
+                parsed = executor.map(parse, htmls, dates) if executor else map(parse, htmls, dates)
+                records = []
+                for (key, _), record in zip(pending, parsed):
+                    if record:
+                        store.put(key, record)
+                        records.append(record)
+                store.commit()
+                stage.add(len(pending))
+            yield from records
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def write_csv_stream(records, roster_future, csv_filename, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Дополняет записи данными команды и сразу дописывает их в CSV.
 
-    my_team = backoffice()
+    Returns:
+        int: Количество записанных строк.
+    """
+    count = 0
+    with open(csv_filename, mode='w', newline='', encoding='utf-8-sig') as file:
+        writer = csv.DictWriter(file, fieldnames=CSV_HEADERS, delimiter=';')
+        writer.writeheader()
+        for count, record in enumerate(records, start=1):
+            record['Примечание'] = team_note(record['Примечание'], record['Регистрационный номер'],
+                                             roster_future.result())
+            writer.writerow(record)
+            if count % chunk_size == 0:
+                file.flush()
+    return count
 
-    update_my_team(data_list, my_team)
 
-    save_to_csv(data_list, f'{config.mail_login.split("@")[0]}.csv')
+def patch_first_registrations(csv_filename, first_marks, roster):
+    """
+    Проставляет "Первая регистрация" строкам, которые уже были записаны до
+    того, как встретился их повтор. Файл переписывается построчно.
+    """
+    if not first_marks:
+        return
+    METRICS.count("csv_rewrites")
+    tmp_filename = f"{csv_filename}.tmp"
+    with open(csv_filename, newline='', encoding='utf-8-sig') as source, \
+            open(tmp_filename, mode='w', newline='', encoding='utf-8-sig') as target:
+        writer = csv.DictWriter(target, fieldnames=CSV_HEADERS, delimiter=';')
+        writer.writeheader()
+        for row in csv.DictReader(source, delimiter=';'):
+            if row['Регистрационный номер'] in first_marks:
+                row['Примечание'] = team_note(FIRST_NOTE, row['Регистрационный номер'], roster)
+            writer.writerow(row)
+    os.replace(tmp_filename, csv_filename)
+
+
+def run_account_streaming(mail_server, mail_login, mail_password, mailbox_name, user, uid_state, store,
+                          workers=1, engine=DEFAULT_ENGINE, imap_slots=None, connections=1,
+                          chunk_size=STREAM_CHUNK_SIZE, buffer_size=STREAM_BUFFER_SIZE, duplicates=None,
+                          load_roster=None):
+    """
+    Потоковый вариант run_account с постоянным расходом памяти.
+
+    Загрузка и разбор писем идут в фоновом потоке через буфер ограниченного
+    размера; выгрузка команды из backoffice - параллельно в другом потоке.
+    Сначала в CSV пишется история из store, затем новые письма по мере
+    загрузки. "Первая регистрация" проставляется после окончания потока.
+
+    Повторы ищутся через duplicates; если индекс не передан, открывается
+    и закрывается индекс аккаунта (DuplicateIndex.for_account).
+    Выгрузку команды возвращает load_roster (по умолчанию - новая загрузка
+    через load_team); так режим наблюдения переиспользует свою выгрузку.
+
+    Returns:
+        int: Количество записанных регистраций.
+    """
+    csv_filename = f'{mail_login.split("@")[0]}.csv'
+    uid_state.bind_store(mail_login, mailbox_name, store.generation)
+
+    def iter_messages():
+        with imap_slots or nullcontext():
+            yield from iter_emails(mail_server, mail_login, mail_password, mailbox_name,
+                                   state=uid_state, chunk_size=chunk_size, connections=connections)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        roster_future = executor.submit(load_roster or (lambda: TeamRoster(load_team(user))))
+        history = store.iter_records(store.last_rowid())
+        new_records = buffered(iter_new_records(iter_messages(), store, workers, engine, chunk_size),
+                               buffer_size)
+        first_marks = set()
+        index = duplicates or DuplicateIndex.for_account(mail_login)
+        try:
+            # Время этапа включает ожидание загрузки и разбора писем, которые идут параллельно
+            with METRICS.stage("write_csv_stream") as stage:
+                count = write_csv_stream(dedupe_stream(chain(history, new_records), first_marks, index),
+                                         roster_future, csv_filename, chunk_size)
+                stage.add(count)
+        finally:
+            # Закрываются здесь, а не сборщиком мусора: соединение SQLite истории принадлежит этому потоку
+            history.close()
+            new_records.close()
+            if duplicates is None:
+                index.close()
+            else:
+                index.commit()
+        patch_first_registrations(csv_filename, first_marks, roster_future.result())
+
+    save_to_html(iter_closed(csv_filename), f'{mail_login.split("@")[0]}.html')
+    return count
+
+
+if __name__ == '__main__':
+    import sys
 
-    add_button_to_closed(data_list)
+    import cli
 
-    save_to_html(data_list, f'{config.mail_login.split("@")[0]}.html')
\ No newline at end of file
+    cli.main(["fetch", *sys.argv[1:]])
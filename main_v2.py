@@ -1,17 +1,26 @@
 import csv
-import re
-from bs4 import BeautifulSoup
-from imap_tools import MailBox
+from functools import partial
 from tqdm import tqdm
 from datetime import datetime
 import pandas as pd
-import config
-from backoffice import backoffice
+from backoffice import load_team
+from duplicate_index import DuplicateIndex
+from extractors import DEFAULT_ENGINE, extract_strings
+from letter_rules import EXTRACTOR
+from mail_fetch import REGISTRATION_SUBJECT, UidState, connect, fetch_registrations
+from pipeline import run_concurrently
+from team import TeamRoster
 
 
 class EmailParser:
     def __init__(
-        self, mail_server: str, mail_login: str, mail_password: str, mailbox: str
+        self,
+        mail_server: str,
+        mail_login: str,
+        mail_password: str,
+        mailbox: str,
+        state: UidState = None,
+        engine: str = DEFAULT_ENGINE,
     ):
         """
         Инициализация класса EmailParser.
@@ -21,11 +30,16 @@ class EmailParser:
             mail_login (str): Логин для почты.
             mail_password (str): Пароль для почты.
             mailbox (str): Название почтового ящика.
+            state (UidState): Хранилище водяных знаков UID. Если не задано,
+                папка читается целиком.
+            engine (str): Движок извлечения текста ("bs4" или "lxml").
         """
         self.mail_server = mail_server
         self.mail_login = mail_login
         self.mail_password = mail_password
         self.mailbox = mailbox
+        self.state = state
+        self.engine = engine
 
     def parse_emails(self) -> list:
         """
@@ -35,43 +49,20 @@ class EmailParser:
             list: Список с данными, извлеченными из писем.
         """
         data_rows = []
-        with MailBox(self.mail_server).login(
+        with connect(self.mail_server).login(
             self.mail_login, self.mail_password
         ) as mailbox:
             # print(mailbox.folder.list())
-            mailbox.folder.set(self.mailbox)
-            for msg in tqdm(mailbox.fetch()):
-                if (
-                    msg.subject
-                    == "Siberian Wellness: новая регистрация в вашей команде!"
-                ):
-                    soup = BeautifulSoup(msg.html, "html.parser")
-                    texts = [
-                        text.get_text(strip=True)
-                        for text in soup.find_all(["h1", "h2", "p", "a"])
-                    ]
+            fetched = fetch_registrations(
+                mailbox, self.mail_login, self.mailbox, self.state
+            )
+            for msg in tqdm(fetched):
+                if msg.subject == REGISTRATION_SUBJECT:
+                    texts = extract_strings(msg.html, self.engine)
                     data_row = [str(msg.date)[:10]] + texts
                     data_rows.append(data_row)
         return data_rows
 
-    @staticmethod
-    def extract_tier(text_list: list) -> str:
-        """
-        Извлекает уровень (тип) регистрации из списка текстов.
-
-        Args:
-            text_list (list): Список строк с текстом письма.
-
-        Returns:
-            str: Уровень регистрации, если найден, иначе None.
-        """
-        text = " ".join(text_list)
-        if "Бизнес-Партнер" in text:
-            return "Бизнес-Партнер"
-        elif "Привилегированный клиент" in text:
-            return "Привилегированный клиент"
-        return None
-
 
 class CSVWriter:
     def __init__(self, filename: str):
@@ -83,17 +74,23 @@ class CSVWriter:
         """
         self.filename = filename
 
-    def save_to_csv(self, data_registration: list, my_team: pd.DataFrame) -> None:
+    def save_to_csv(
+        self, data_registration: list, my_team: pd.DataFrame, duplicates: DuplicateIndex = None
+    ) -> None:
         """
         Сохраняет данные регистрации в CSV файл.
 
         Args:
             data_registration (list): Список данных регистрации.
-            my_team (pandas.DataFrame): DataFrame с информацией о команде.
+            my_team (pandas.DataFrame | TeamRoster): Информация о команде.
+            duplicates (DuplicateIndex): Индекс повторов. Если не задан,
+                повторы ищутся только среди data_registration.
 
         Returns:
             None
         """
+        roster = my_team if isinstance(my_team, TeamRoster) else TeamRoster(my_team)
+        duplicates = duplicates or DuplicateIndex(":memory:")
         with open(self.filename, "w", newline="", encoding="utf-8-sig") as csv_file:
             writer = csv.writer(csv_file, delimiter=";")
             writer.writerow(
@@ -110,56 +107,26 @@ class CSVWriter:
             )
 
             for row in tqdm(data_registration):
-                index = next(
-                    (
-                        idx
-                        for idx, item in enumerate(row)
-                        if "Регистрационный номер:" in item
-                        or "Номер Соглашения:" in item
-                    ),
-                    None,
-                )
-                if index is not None:
-                    registration_numbers = (
-                        row[index]
-                        .replace("Регистрационный номер:", "")
-                        .replace("Номер Соглашения:", "")
-                    )
-                    data = str(row)
-
-                    phone_match = re.search(r"\d{11}|375\d{9}", data)
-                    phones = phone_match.group() if phone_match else "---"
-
-                    email_match = re.findall(
-                        r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b", data
-                    )
-                    emails = email_match[0] if email_match else "---"
-
-                    name = row[index - 1]
-                    tier = EmailParser.extract_tier(row)
-                    info = ""
-
-                    if my_team["ФИО"].tolist().count(name) > 1:
-                        info = "Повторная регистрация"
-
-                    if my_team["E-mail"].tolist().count(emails) > 1:
-                        info = "Повторная регистрация"
-
-                    if my_team["Телефон"].tolist().count(int(phones)) > 1:
-                        info = "Повторная регистрация"
-
-                    if (
-                        not my_team["Регистрационный номер"]
-                        .tolist()
-                        .count(int(registration_numbers))
-                    ):
+                extracted = EXTRACTOR.extract(row[1:])
+                if extracted is not None:
+                    name = extracted["Имя"]
+                    registration_numbers = extracted["Регистрационный номер"]
+                    tier = extracted["Тип"]
+                    record = {
+                        "Имя": name,
+                        "Телефон": extracted["Телефон"] or "",
+                        "Почта": extracted["Почта"] or "",
+                        "Регистрационный номер": registration_numbers,
+                    }
+                    phones = record["Телефон"] or "---"
+                    emails = record["Почта"] or "---"
+                    duplicates.check(record)
+                    info = record["Примечание"]
+
+                    if registration_numbers not in roster:
                         info += " Закрыт"
                     else:
-                        noo_value = my_team.loc[
-                            my_team["Регистрационный номер"]
-                            == int(registration_numbers),
-                            "НОО",
-                        ].values[0]
+                        noo_value = roster.noo(registration_numbers)
                         if bool(int(noo_value)):
                             info += f" {noo_value}"
 
@@ -182,18 +149,30 @@ class CSVWriter:
                         whatsapp,
                     ]
                     writer.writerow(new_list)
+        duplicates.commit()
+
+
+def run_account(mail_server, mail_login, mail_password, mailbox_name, user, engine=DEFAULT_ENGINE):
+    """
+    Полный цикл обработки аккаунта с CSV в формате main_v2 (столбец WhatsApp с формулой ГИПЕРССЫЛКА).
+
+    CSV каждый раз переписывается целиком, поэтому папка читается полностью,
+    без водяного знака UID: иначе повторный запуск оставил бы в отчете только новые письма.
+    """
+    parser = EmailParser(mail_server, mail_login, mail_password, mailbox_name, engine=engine)
+    results = run_concurrently(registrations=parser.parse_emails, team=partial(load_team, user))
+
+    duplicates = DuplicateIndex.for_account(mail_login)
+    try:
+        csv_writer = CSVWriter(f'{mail_login.split("@")[0]}.csv')
+        csv_writer.save_to_csv(results["registrations"], results["team"], duplicates)
+    finally:
+        duplicates.close()
 
 
 if __name__ == "__main__":
-    parser = EmailParser(
-        mail_server=config.mail_server,
-        mail_login=config.mail_login,
-        mail_password=config.mail_password,
-        mailbox=config.mailbox,
-    )
-
-    my_team = backoffice()
-    new_registration = parser.parse_emails()
-
-    csv_writer = CSVWriter(f'{config.mail_login.split("@")[0]}.csv')
-    csv_writer.save_to_csv(new_registration, my_team)
+    import sys
+
+    import cli
+
+    cli.main(["fetch", "--v2", *sys.argv[1:]])
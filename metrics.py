@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import config
+
+METRICS_FILE = getattr(config, "metrics_file", "run_report.json")
+# Файл для textfile collector из node_exporter (например, /var/lib/node_exporter/sw_parser.prom); None - не писать
+PROMETHEUS_TEXTFILE = getattr(config, "prometheus_textfile", None)
+PROMETHEUS_PREFIX = "sw_parser"
+
+
+class Stage:
+    def __init__(self):
+        self.items = 0
+
+    def add(self, items: int = 1) -> None:
+        self.items += items
+
+
+class RunMetrics:
+    def __init__(self):
+        """
+        Показатели одного запуска: время и количество элементов по этапам,
+        счетчики (байты, попадания в кэш, попытки капчи) и длительности
+        отдельных операций (HTTP-запросы, решение капчи).
+
+        Потокобезопасно: этапы разных аккаунтов и потоков складываются.
+        """
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Начинает новый запуск (например, следующий замер в bench.py).
+        """
+        with self._lock:
+            self.started = time.time()
+            self.stages = {}
+            self.counters = {}
+            self.timings = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Замеряет время блока; повторные вызовы этапа суммируются.
+
+        Yields:
+            Stage: Объект, через который блок сообщает количество обработанных элементов.
+        """
+        current = Stage()
+        started = time.perf_counter()
+        try:
+            yield current
+        finally:
+            seconds = time.perf_counter() - started
+            with self._lock:
+                totals = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0, "items": 0})
+                totals["seconds"] += seconds
+                totals["calls"] += 1
+                totals["items"] += current.items
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """
+        Добавляет длительность одной операции (например, HTTP-запроса) в сводку name.
+        """
+        with self._lock:
+            summary = self.timings.setdefault(name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            summary["count"] += 1
+            summary["seconds"] += seconds
+            summary["max_seconds"] = max(summary["max_seconds"], seconds)
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                "seconds": round(time.time() - self.started, 3),
+                "stages": {name: {**values, "seconds": round(values["seconds"], 4)}
+                           for name, values in self.stages.items()},
+                "counters": dict(self.counters),
+                "timings": {name: {**values, "seconds": round(values["seconds"], 4),
+                                   "max_seconds": round(values["max_seconds"], 4)}
+                            for name, values in self.timings.items()},
+            }
+
+    def write_json(self, filename: str = METRICS_FILE) -> None:
+        _write_atomic(filename, json.dumps(self.report(), ensure_ascii=False, indent=2))
+
+    def write_prometheus(self, filename: str = PROMETHEUS_TEXTFILE) -> None:
+        """
+        Записывает показатели в формате textfile collector для Prometheus.
+        """
+        report = self.report()
+        lines = [
+            f"# TYPE {PROMETHEUS_PREFIX}_last_run_timestamp_seconds gauge",
+            f"{PROMETHEUS_PREFIX}_last_run_timestamp_seconds {self.started:.0f}",
+            f"# TYPE {PROMETHEUS_PREFIX}_run_seconds gauge",
+            f"{PROMETHEUS_PREFIX}_run_seconds {report['seconds']}",
+        ]
+        for metric, key in (("stage_seconds", "seconds"), ("stage_calls", "calls"), ("stage_items", "items")):
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{metric} gauge")
+            lines.extend(f'{PROMETHEUS_PREFIX}_{metric}{{stage="{name}"}} {values[key]}'
+                         for name, values in report["stages"].items())
+        for name, value in report["counters"].items():
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name}_total counter")
+            lines.append(f"{PROMETHEUS_PREFIX}_{name}_total {value}")
+        for name, values in report["timings"].items():
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name}_seconds summary")
+            lines.append(f"{PROMETHEUS_PREFIX}_{name}_seconds_sum {values['seconds']}")
+            lines.append(f"{PROMETHEUS_PREFIX}_{name}_seconds_count {values['count']}")
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name}_max_seconds gauge")
+            lines.append(f"{PROMETHEUS_PREFIX}_{name}_max_seconds {values['max_seconds']}")
+        _write_atomic(filename, "\n".join(lines) + "\n")
+
+    def write(self, json_filename: str = METRICS_FILE, prometheus_filename: str = PROMETHEUS_TEXTFILE) -> None:
+        """
+        Сохраняет отчет о запуске в JSON и, если задан файл, в формате Prometheus.
+        """
+        if json_filename:
+            self.write_json(json_filename)
+        if prometheus_filename:
+            self.write_prometheus(prometheus_filename)
+
+
+def _write_atomic(filename: str, text: str) -> None:
+    # node_exporter не должен прочитать недописанный файл
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, "w", encoding="utf-8") as file:
+        file.write(text)
+    os.replace(tmp_filename, filename)
+
+
+# Показатели текущего процесса
+METRICS = RunMetrics()
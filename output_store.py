@@ -0,0 +1,118 @@
+import csv
+import os
+import sqlite3
+
+import pandas as pd
+
+import config
+from enrichment import CSV_HEADERS
+
+# {account} заменяется на имя почтового ящика до "@"
+OUTPUT_STORE_FILE = getattr(config, "output_store_file", "{account}_rows.sqlite3")
+
+COLUMNS = (
+    ("Регистрационный номер", "reg_number"),
+    ("Дата", "date"),
+    ("Имя", "name"),
+    ("Телефон", "phone"),
+    ("Почта", "email"),
+    ("Тип", "tier"),
+    ("Примечание", "note"),
+)
+
+
+class OutputStore:
+    def __init__(self, filename: str):
+        """
+        Постоянное хранилище строк отчета с ключом по регистрационному номеру.
+
+        Args:
+            filename (str): Файл базы данных SQLite.
+        """
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS rows (reg_number TEXT PRIMARY KEY, "
+            + ", ".join(f"{column} TEXT" for field, column in COLUMNS[1:])
+            + ")"
+        )
+
+    @classmethod
+    def for_account(cls, mail_login: str) -> "OutputStore":
+        return cls(OUTPUT_STORE_FILE.format(account=mail_login.split("@")[0]))
+
+    def rows(self) -> pd.DataFrame:
+        """
+        Возвращает все строки отчета со столбцами CSV_HEADERS.
+        """
+        frame = pd.read_sql_query(
+            f"SELECT {', '.join(column for _, column in COLUMNS)} FROM rows ORDER BY rowid", self.connection
+        )
+        frame.columns = [field for field, _ in COLUMNS]
+        return frame[CSV_HEADERS]
+
+    def upsert(self, report: pd.DataFrame) -> pd.DataFrame:
+        """
+        Добавляет новые строки и обновляет изменившиеся.
+
+        Строки сравниваются по всем столбцам CSV, поэтому, например,
+        регистрация, ставшая "Закрыто", попадет в результат, а неизменные
+        строки - нет.
+
+        Args:
+            report (pandas.DataFrame): Обогащенные регистрации (результат enrich).
+
+        Returns:
+            pandas.DataFrame: Новые и изменившиеся строки.
+        """
+        incoming = report[CSV_HEADERS].astype(object).where(report[CSV_HEADERS].notna(), "").astype(str)
+        incoming = incoming.drop_duplicates(subset="Регистрационный номер", keep="last")
+        existing = self.rows()
+        merged = incoming.merge(existing, how="left", on="Регистрационный номер",
+                                suffixes=("", "_old"), indicator=True)
+        changed = merged["_merge"] == "left_only"
+        for field in CSV_HEADERS:
+            if field != "Регистрационный номер":
+                changed |= merged[field] != merged[f"{field}_old"].fillna("")
+        changed_rows = merged.loc[changed, CSV_HEADERS]
+
+        self.connection.executemany(
+            f"INSERT INTO rows ({', '.join(column for _, column in COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(COLUMNS))}) "
+            "ON CONFLICT(reg_number) DO UPDATE SET "
+            + ", ".join(f"{column} = excluded.{column}" for _, column in COLUMNS[1:]),
+            changed_rows[[field for field, _ in COLUMNS]].itertuples(index=False, name=None),
+        )
+        self.connection.commit()
+        return changed_rows
+
+    def append_to_csv(self, report: pd.DataFrame, csv_filename: str) -> int:
+        """
+        Сохраняет отчет и дописывает в CSV только новые и изменившиеся строки.
+
+        Если хранилище пустое (первый запуск), CSV создается заново.
+
+        Returns:
+            int: Количество дописанных строк.
+        """
+        is_new = self.connection.execute("SELECT COUNT(*) FROM rows").fetchone()[0] == 0
+        changed_rows = self.upsert(report)
+        if is_new or not os.path.exists(csv_filename):
+            changed_rows = self.rows()
+            mode, encoding = "w", "utf-8-sig"
+        else:
+            mode, encoding = "a", "utf-8"
+        with open(csv_filename, mode=mode, newline="", encoding=encoding) as file:
+            writer = csv.writer(file, delimiter=";")
+            if mode == "w":
+                writer.writerow(CSV_HEADERS)
+            writer.writerows(changed_rows.itertuples(index=False, name=None))
+        return len(changed_rows)
+
+    def export_parquet(self, filename: str) -> None:
+        """
+        Выгружает все строки отчета в Parquet для аналитики.
+        """
+        self.rows().to_parquet(filename, index=False)
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,142 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from queue import Full, Queue
+from threading import Event, Thread
+
+_ITEM, _DONE, _ERROR = object(), object(), object()
+
+
+class StageError(RuntimeError):
+    pass
+
+
+def run_concurrently(**stages) -> dict:
+    """
+    Выполняет независимые этапы (например, загрузку почты и выгрузку из
+    backoffice) параллельно в потоках и дожидается завершения всех.
+
+    Args:
+        **stages: Имя этапа -> функция без аргументов.
+
+    Returns:
+        dict: Имя этапа -> результат функции.
+
+    Raises:
+        StageError: Если хотя бы один этап завершился ошибкой; в сообщении
+            перечислены все упавшие этапы.
+    """
+    with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+        futures = {name: executor.submit(stage) for name, stage in stages.items()}
+
+    results = {}
+    errors = {}
+    for name, future in futures.items():
+        error = future.exception()
+        if error is None:
+            results[name] = future.result()
+        else:
+            errors[name] = error
+
+    if errors:
+        message = "; ".join(f"этап '{name}': {type(error).__name__}: {error}" for name, error in errors.items())
+        raise StageError(f"Ошибка выполнения: {message}") from next(iter(errors.values()))
+    return results
+
+
+def chunked(iterable, size: int):
+    """
+    Разбивает итерируемый объект на списки не длиннее size, не читая его целиком.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class BufferedIterator:
+    def __init__(self, iterable, maxsize: int):
+        """
+        Выполняет итерацию в фоновом потоке через очередь ограниченного размера.
+
+        Поток запускается сразу при создании. Производитель (например,
+        загрузка и разбор писем) работает параллельно с потребителем, но
+        опережает его не более чем на maxsize элементов. Исключение
+        производителя выбрасывается у потребителя.
+
+        Args:
+            iterable: Источник элементов.
+            maxsize (int): Размер буфера.
+        """
+        self._items = Queue(maxsize=maxsize)
+        self._stopped = Event()
+        self._finished = False
+        Thread(target=self._produce, args=(iterable,), daemon=True).start()
+
+    def _put(self, kind, value) -> bool:
+        while not self._stopped.is_set():
+            try:
+                self._items.put((kind, value), timeout=0.5)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _produce(self, iterable) -> None:
+        try:
+            for item in iterable:
+                if not self._put(_ITEM, item):
+                    return
+            self._put(_DONE, None)
+        except BaseException as e:
+            self._put(_ERROR, e)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+        kind, value = self._items.get()
+        if kind is _ITEM:
+            return value
+        self.close()
+        if kind is _ERROR:
+            raise value
+        raise StopIteration
+
+    def close(self) -> None:
+        """
+        Останавливает производителя, если потребителю больше не нужны элементы.
+        """
+        self._finished = True
+        self._stopped.set()
+
+
+def buffered(iterable, maxsize: int) -> BufferedIterator:
+    return BufferedIterator(iterable, maxsize)
+
+
+def dedupe_stream(records, first_marks: set, duplicates):
+    """
+    Потоковый вариант main.check_duplicates.
+
+    Повтор отмечается сразу, а регистрационный номер более ранней записи,
+    которая должна получить "Первая регистрация", добавляется в first_marks:
+    к этому моменту она уже передана дальше (или выведена в прошлом
+    запуске), и отметку проставляют после окончания потока.
+
+    Args:
+        records: Поток словарей с данными регистраций.
+        first_marks (set): Сюда добавляются номера первых регистраций.
+        duplicates (DuplicateIndex): Индекс повторов.
+
+    Yields:
+        dict: Регистрации в исходном порядке.
+    """
+    for element in records:
+        first = duplicates.check(element)
+        if first is not None:
+            first_marks.add(first)
+        yield element
@@ -0,0 +1,129 @@
+import sqlite3
+import uuid
+
+import config
+
+STORE_FILE = getattr(config, "registration_store_file", "registrations.sqlite3")
+# Размер страницы при чтении истории (см. RegistrationStore.iter_records)
+HISTORY_PAGE_SIZE = getattr(config, "registration_history_page_size", 1000)
+
+# Увеличивайте при любом изменении извлечения данных из писем: старые записи будут удалены,
+# а письма перечитаны заново (см. generation)
+# 2: телефоны 375 и 9 цифр целиком, цифры из адреса почты не принимаются за телефон
+SCHEMA_VERSION = 2
+
+FIELDS = (
+    ("Дата", "date"),
+    ("Имя", "name"),
+    ("Регистрационный номер", "reg_number"),
+    ("Телефон", "phone"),
+    ("Почта", "email"),
+    ("Тип", "tier"),
+)
+
+
+class RegistrationStore:
+    def __init__(self, filename: str = STORE_FILE):
+        """
+        Локальное хранилище уже разобранных писем о регистрации.
+
+        Args:
+            filename (str): Файл базы данных SQLite.
+        """
+        # Хранилище заполняется в потоке загрузки почты, а закрывается в основном потоке
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        row = self.connection.execute("SELECT value FROM meta WHERE name = 'generation'").fetchone()
+        if version != SCHEMA_VERSION or row is None:
+            self.connection.execute("DROP TABLE IF EXISTS registrations")
+            self.connection.execute(
+                "CREATE TABLE registrations (key TEXT PRIMARY KEY, "
+                + ", ".join(f"{column} TEXT" for _, column in FIELDS)
+                + ")"
+            )
+            # Новое поколение хранилища: водяные знаки UID, сохраненные для прежнего, недействительны
+            self.generation = uuid.uuid4().hex
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('generation', ?)", (self.generation,))
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.connection.commit()
+        else:
+            self.generation = row[0]
+
+    @staticmethod
+    def message_key(msg) -> str:
+        """
+        Возвращает ключ письма: Message-ID, а при его отсутствии UID.
+        """
+        message_id = msg.headers.get("message-id", ("",))[0].strip()
+        return message_id or f"uid:{msg.uid}"
+
+    @staticmethod
+    def _to_record(row: tuple) -> dict:
+        record = {field: value for (field, _), value in zip(FIELDS, row)}
+        record["Примечание"] = ""
+        return record
+
+    def get(self, key: str) -> dict:
+        """
+        Возвращает сохраненную запись по ключу письма или None.
+        """
+        row = self.connection.execute(
+            f"SELECT {', '.join(column for _, column in FIELDS)} FROM registrations WHERE key = ?",
+            (key,),
+        ).fetchone()
+        return self._to_record(row) if row else None
+
+    def put(self, key: str, record: dict) -> None:
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO registrations VALUES ({', '.join('?' * (len(FIELDS) + 1))})",
+            (key, *(record[field] for field, _ in FIELDS)),
+        )
+
+    def records(self) -> list:
+        """
+        Возвращает все сохраненные записи в порядке добавления.
+        """
+        rows = self.connection.execute(
+            f"SELECT {', '.join(column for _, column in FIELDS)} FROM registrations ORDER BY rowid"
+        )
+        return [self._to_record(row) for row in rows]
+
+    def last_rowid(self) -> int:
+        return self.connection.execute("SELECT COALESCE(MAX(rowid), 0) FROM registrations").fetchone()[0]
+
+    def iter_records(self, upto_rowid: int, page_size: int = HISTORY_PAGE_SIZE):
+        """
+        Построчно читает записи с rowid <= upto_rowid через отдельное соединение.
+
+        Граница по rowid отделяет историю от записей, которые добавляются
+        параллельно в ходе текущего запуска. Записи читаются страницами по
+        page_size строк, и курсор закрывается между страницами: пока
+        потребитель обрабатывает историю (например, ждет выгрузку команды),
+        чтение не держит блокировку базы и не мешает фиксировать новые записи.
+        """
+        columns = ', '.join(column for _, column in FIELDS)
+        connection = sqlite3.connect(self.filename)
+        try:
+            after = 0
+            while True:
+                rows = connection.execute(
+                    f"SELECT rowid, {columns} FROM registrations "
+                    "WHERE rowid > ? AND rowid <= ? ORDER BY rowid LIMIT ?",
+                    (after, upto_rowid, page_size),
+                ).fetchall()
+                if not rows:
+                    return
+                after = rows[-1][0]
+                for row in rows:
+                    yield self._to_record(row[1:])
+        finally:
+            connection.close()
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
@@ -0,0 +1,127 @@
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import config
+from metrics import METRICS
+
+RETRY_BASE_DELAY = getattr(config, "retry_base_delay", 2)
+RETRY_MAX_DELAY = getattr(config, "retry_max_delay", 60)
+
+
+class RetryError(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds: float = None):
+        """
+        Общий срок на несколько шагов с повторами.
+
+        Args:
+            seconds (float): Сколько секунд осталось; None - без ограничения.
+        """
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float("inf")
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+class RetryPolicy:
+    def __init__(self, attempts: int, base_delay: float = RETRY_BASE_DELAY, max_delay: float = RETRY_MAX_DELAY):
+        """
+        Бюджет повторов одного шага.
+
+        Задержка перед повтором растет экспоненциально (base_delay, 2 * base_delay, ...
+        не больше max_delay) и выбирается случайно от нуля до этого значения,
+        чтобы одновременные клиенты не повторяли запросы синхронно.
+
+        Args:
+            attempts (int): Максимальное количество попыток.
+            base_delay (float): Задержка перед первым повтором, в секундах.
+            max_delay (float): Наибольшая задержка, в секундах.
+        """
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+def call_with_retry(step: str, function, policy: RetryPolicy, deadline: Deadline = None,
+                    retry_on: tuple = (Exception,)):
+    """
+    Вызывает function, повторяя ее при ошибках retry_on в пределах policy и deadline.
+
+    Попытки и ошибки считаются в metrics как <step>_attempts и <step>_errors.
+
+    Args:
+        step (str): Название шага для сообщений и показателей.
+        function: Функция без аргументов.
+        policy (RetryPolicy): Бюджет повторов.
+        deadline (Deadline): Общий срок или None.
+        retry_on (tuple): Исключения, после которых имеет смысл повторить.
+
+    Returns:
+        Результат function.
+
+    Raises:
+        RetryError: Если попытки или срок исчерпаны; исходная ошибка - в __cause__.
+    """
+    deadline = deadline or Deadline()
+    for attempt in range(1, policy.attempts + 1):
+        if deadline.remaining() <= 0:
+            raise RetryError(f"{step}: истек общий срок")
+        METRICS.count(f"{step}_attempts")
+        try:
+            return function()
+        except retry_on as e:
+            METRICS.count(f"{step}_errors")
+            error = e
+        if attempt == policy.attempts:
+            break
+        delay = policy.delay(attempt)
+        if delay >= deadline.remaining():
+            raise RetryError(f"{step}: истек общий срок, последняя ошибка: {error}") from error
+        print(f"{step}: попытка {attempt} из {policy.attempts} не удалась ({error}), повтор через {delay:.1f} с")
+        time.sleep(delay)
+    raise RetryError(f"{step}: не удалось за {policy.attempts} попыток: {error}") from error
+
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def single_flight(key: str, function):
+    """
+    Выполняет function один раз для всех потоков, одновременно запросивших один key.
+
+    Первый поток выполняет function, остальные дожидаются и получают тот же
+    результат (или то же исключение). Например, при пакетной обработке
+    нескольких ящиков одного партнера вход в backoffice с капчей выполняется
+    один раз.
+    """
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = _in_flight[key] = Future()
+    if not owner:
+        METRICS.count("single_flight_reuses")
+        return future.result()
+
+    try:
+        result = function()
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
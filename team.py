@@ -0,0 +1,34 @@
+import pandas as pd
+
+
+def _is_missing(value) -> bool:
+    return value is None or (not isinstance(value, str) and pd.isna(value))
+
+
+class TeamRoster:
+    def __init__(self, team: pd.DataFrame):
+        """
+        Индексы по выгрузке команды из backoffice для поиска за O(1).
+
+        Строится один раз: НОО по регистрационному номеру (первое вхождение,
+        как в .loc[...].values[0]).
+
+        Args:
+            team (pandas.DataFrame): Выгрузка "Моя команда".
+        """
+        self.noo_by_reg_number = {}
+        for reg_number, noo_value in zip(team["Регистрационный номер"], team["НОО"]):
+            if not _is_missing(reg_number):
+                self.noo_by_reg_number.setdefault(int(reg_number), noo_value)
+
+    def __contains__(self, reg_number) -> bool:
+        return int(reg_number) in self.noo_by_reg_number
+
+    def __len__(self) -> int:
+        return len(self.noo_by_reg_number)
+
+    def noo(self, reg_number):
+        """
+        Возвращает НОО участника или None, если его нет в команде.
+        """
+        return self.noo_by_reg_number.get(int(reg_number))
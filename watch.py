@@ -0,0 +1,173 @@
+import csv
+import imaplib
+import random
+import time
+
+from imap_tools.errors import ImapToolsError
+
+import config
+from backoffice import REPORT_CACHE_TTL, BackofficeError, load_team
+from duplicate_index import DuplicateIndex
+from enrichment import CSV_HEADERS, team_note
+from extractors import DEFAULT_ENGINE
+from html_report import CLOSED_NOTES, iter_closed
+from mail_fetch import UidState, connect, fetch_registrations
+from main import parse_registration, patch_first_registrations, run_account_streaming, save_to_html
+from metrics import METRICS
+from pipeline import dedupe_stream
+from registration_store import RegistrationStore
+from retry import RetryError
+from team import TeamRoster
+
+IDLE_TIMEOUT = getattr(config, "watch_idle_timeout", 5 * 60)
+ROSTER_REFRESH = getattr(config, "watch_roster_refresh", REPORT_CACHE_TTL)
+ROSTER_RETRY = getattr(config, "watch_roster_retry", 5 * 60)
+RECONNECT_MAX_DELAY = getattr(config, "watch_reconnect_max_delay", 5 * 60)
+
+
+class RegistrationWatcher:
+    def __init__(self, mail_server: str, mail_login: str, mail_password: str, mailbox: str, user: dict,
+                 uid_state: UidState, store: RegistrationStore, engine: str = DEFAULT_ENGINE,
+                 duplicates: DuplicateIndex = None):
+        """
+        Долгоживущий обработчик новых писем о регистрации через IMAP IDLE.
+
+        Держит одно подключение к почте, выгрузку команды в памяти и открытый
+        индекс повторов, а каждую новую регистрацию сразу дописывает в CSV/HTML.
+
+        Args:
+            mail_server (str): Сервер почты.
+            mail_login (str): Логин для почты.
+            mail_password (str): Пароль для почты.
+            mailbox (str): Название почтового ящика.
+            user (dict): Номер и пароль для backoffice.
+            uid_state (UidState): Хранилище водяных знаков UID.
+            store (RegistrationStore): Хранилище разобранных писем.
+            engine (str): Движок извлечения текста.
+            duplicates (DuplicateIndex): Индекс повторов; по умолчанию - индекс аккаунта.
+        """
+        self.mail_server = mail_server
+        self.mail_login = mail_login
+        self.mail_password = mail_password
+        self.mailbox = mailbox
+        self.user = user
+        self.uid_state = uid_state
+        self.store = store
+        self.engine = engine
+        self.csv_filename = f'{mail_login.split("@")[0]}.csv'
+        self.html_filename = f'{mail_login.split("@")[0]}.html'
+        self.duplicates = duplicates or DuplicateIndex.for_account(mail_login)
+        self._roster = None
+        self._roster_expires_at = 0.0
+
+    def roster(self) -> TeamRoster:
+        """
+        Возвращает выгрузку команды, обновляя ее не чаще раза в ROSTER_REFRESH секунд.
+
+        Если обновить выгрузку не удалось, используется прежняя, а новая
+        попытка делается через ROSTER_RETRY секунд.
+
+        Raises:
+            BackofficeError: Если выгрузку не удалось получить ни разу.
+        """
+        if self._roster is not None and time.time() < self._roster_expires_at:
+            return self._roster
+        try:
+            roster = TeamRoster(load_team(self.user))
+        except (BackofficeError, RetryError) as e:
+            if self._roster is None:
+                raise
+            print(f"Не удалось обновить выгрузку команды: {e}. Используется прежняя, повтор через {ROSTER_RETRY} с")
+            METRICS.count("roster_refresh_failures")
+            self._roster_expires_at = time.time() + ROSTER_RETRY
+            return self._roster
+        self._roster = roster
+        self._roster_expires_at = time.time() + ROSTER_REFRESH
+        return self._roster
+
+    def catch_up(self) -> None:
+        """
+        Полностью пересобирает выходные файлы перед ожиданием новых писем.
+
+        Выгрузка команды берется через roster(), поэтому она остается в памяти
+        для следующих писем.
+        """
+        run_account_streaming(self.mail_server, self.mail_login, self.mail_password, self.mailbox,
+                              self.user, self.uid_state, self.store, engine=self.engine,
+                              duplicates=self.duplicates, load_roster=self.roster)
+        self.uid_state.save()
+
+    def append(self, record: dict) -> None:
+        """
+        Дописывает одну регистрацию в CSV и при необходимости обновляет HTML.
+        """
+        first_marks = set()
+        record = next(dedupe_stream([record], first_marks, self.duplicates))
+        self.duplicates.commit()
+        roster = self.roster()
+        record['Примечание'] = team_note(record['Примечание'], record['Регистрационный номер'], roster)
+        with open(self.csv_filename, mode='a', newline='', encoding='utf-8') as file:
+            csv.DictWriter(file, fieldnames=CSV_HEADERS, delimiter=';').writerow(record)
+        patch_first_registrations(self.csv_filename, first_marks, roster)
+        if first_marks or record['Примечание'] in CLOSED_NOTES:
+            save_to_html(iter_closed(self.csv_filename), self.html_filename)
+        print(f"Новая регистрация: {record['Имя']} ({record['Регистрационный номер']}) {record['Примечание']}")
+
+    def process_new(self, mailbox) -> None:
+        """
+        Обрабатывает новые письма и обновляет файлы показателей (см. metrics).
+        """
+        for msg in fetch_registrations(mailbox, self.mail_login, self.mailbox, self.uid_state):
+            key = self.store.message_key(msg)
+            if self.store.get(key) is not None:
+                continue
+            record = parse_registration(msg.html, str(msg.date)[:10], self.engine)
+            if not record:
+                continue
+            self.store.put(key, record)
+            self.store.commit()
+            with METRICS.stage("watch_append") as stage:
+                self.append(record)
+                stage.add()
+        self.uid_state.save()
+        METRICS.write()
+
+    def run(self) -> None:
+        """
+        Ожидает новые письма через IDLE, повторяя с экспоненциальной задержкой
+        и первичную сверку (catch_up), и подключение.
+
+        Если не удалось получить выгрузку команды, письмо уже сохранено в
+        store, но не попало в CSV; поэтому после такой ошибки выходные файлы
+        пересобираются заново через catch_up.
+        """
+        delay = 1
+        caught_up = False
+        while True:
+            try:
+                if not caught_up:
+                    self.catch_up()
+                    caught_up = True
+                with connect(self.mail_server).login(self.mail_login, self.mail_password) as mailbox:
+                    delay = 1
+                    self.process_new(mailbox)
+                    while True:
+                        if mailbox.idle.wait(timeout=IDLE_TIMEOUT):
+                            self.process_new(mailbox)
+            except (ImapToolsError, imaplib.IMAP4.error, OSError) as e:
+                print(f"Соединение с почтой потеряно: {e}. Повтор через {delay} с")
+                METRICS.count("imap_reconnects")
+            except (BackofficeError, RetryError) as e:
+                print(f"Не удалось получить выгрузку команды: {e}. Повтор через {delay} с")
+                METRICS.count("roster_load_failures")
+                caught_up = False
+            time.sleep(delay + random.uniform(0, 1))
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+
+if __name__ == "__main__":
+    import sys
+
+    import cli
+
+    cli.main(["watch", *sys.argv[1:]])